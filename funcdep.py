@@ -1,10 +1,296 @@
+import collections
+import concurrent.futures
+import contextlib
 import functools
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import operator
 import os
+import pathlib
+import random
 import sqlite3
-import copy
+import sys
+import tempfile
+import time
+import tracemalloc
 
+import funcdep_discover
 import utils
 
+try:
+    import funcdep_numpy
+except ImportError:
+    # NumPy est facultatif: seul le moteur de vérification 'numpy' en a besoin
+    funcdep_numpy = None
+
+
+# Tables créées par l'application, qui ne sont pas des données à analyser
+_INTERNAL_TABLES = ('FuncDep', 'FuncDepLog', 'FuncDepChecked', 'FuncDepCache')
+
+# Moteurs de vérification des DF: une requête par DF, ou une lecture par table en colonnes NumPy
+ENGINES = ('sql', 'numpy')
+
+# Numéros de version des ensembles de DF, uniques pour tout le processus
+_VERSIONS = itertools.count()
+
+Violation = collections.namedtuple('Violation', ['df', 'lhs', 'count', 'rhs_count', 'sample'])
+
+# Résultat de la vérification d'une DF sur un échantillon: hits tuples en violation sur size,
+# [low, high] est l'intervalle de confiance à 95% de la proportion de tuples en violation
+Sample = collections.namedtuple('Sample', ['df', 'size', 'hits', 'rows', 'low', 'high', 'probed'])
+
+# Écart d'une DF aux données: removed tuples à supprimer (au minimum) sur rows pour qu'elle soit
+# respectée, g3 = removed / rows, groups groupes de la prémisse en violation, worst les plus coûteux
+DFError = collections.namedtuple('DFError', ['df', 'rows', 'removed', 'g3', 'groups', 'worst'])
+
+# Groupe de la prémisse en violation: count tuples, rhs_count valeurs, removed tuples à supprimer
+ErrorGroup = collections.namedtuple('ErrorGroup', ['lhs', 'count', 'rhs_count', 'removed'])
+
+
+def _distinct_count(rhs: str) -> str:
+    """Nombre de valeurs distinctes d'un champ dans un groupe, NULL compris (COUNT(DISTINCT) l'ignore)"""
+    return 'COUNT(DISTINCT {0}) + (COUNT(*) > COUNT({0}))'.format(rhs)
+
+
+def _groups_query(df: tuple, limit: int = None, where: str = None) -> str:
+    """
+    Requête renvoyant, pour chaque groupe de la prémisse qui viole une DF,
+    les valeurs de la prémisse, le nombre de tuples et le nombre de valeurs
+    du champ déterminé. Avec une limite, les plus gros groupes d'abord; avec
+    une condition, seuls les tuples qui la vérifient sont groupés.
+    """
+    table = utils.quote(df[0])
+    lhs = ', '.join(utils.quote(f) for f in df[1].split())
+    rhs = utils.quote(df[2])
+
+    request = 'SELECT {} COUNT(*), {} FROM {}'.format(lhs + ',' if lhs else '', _distinct_count(rhs), table)
+    request += ' WHERE ' + where if where else ''
+    request += ' GROUP BY ' + lhs if lhs else ''
+    request += ' HAVING {} > 1'.format(_distinct_count(rhs))
+
+    if limit is not None:
+        request += ' ORDER BY COUNT(*) DESC LIMIT {:d}'.format(limit)
+
+    return request
+
+
+def _group_condition(df: tuple) -> str:
+    """Condition (paramétrée) sélectionnant un groupe de la prémisse"""
+    lhs = df[1].split()
+    return ' AND '.join('{} IS ?'.format(utils.quote(f)) for f in lhs) if lhs else '1'
+
+
+def _violations_query(df: tuple) -> str:
+    """
+    Requête renvoyant les tuples qui violent une DF: les groupes de la
+    prémisse sont trouvés en un seul GROUP BY puis joints à la table.
+    """
+    lhs = [utils.quote(f) for f in df[1].split()]
+    join = ' AND '.join('t.{0} IS v.{0}'.format(f) for f in lhs) if lhs else '1'
+
+    return 'SELECT DISTINCT t.* FROM {} AS t JOIN ({}) AS v ON {} ORDER BY t.rowid;'.format(
+        utils.quote(df[0]), _groups_query(df), join)
+
+
+def _error_groups_query(df: tuple) -> str:
+    """
+    Requête renvoyant, pour chaque groupe de la prémisse qui viole une DF,
+    les valeurs de la prémisse, le nombre de tuples, celui de la valeur la
+    plus fréquente du champ déterminé et le nombre de valeurs.
+    """
+    lhs = [utils.quote(f) for f in df[1].split()]
+    keys = ', '.join('g{}'.format(n) for n in range(len(lhs)))
+
+    pairs = 'SELECT {} COUNT(*) AS `n` FROM {} GROUP BY {}'.format(
+        ''.join('{} AS g{}, '.format(f, n) for n, f in enumerate(lhs)), utils.quote(df[0]),
+        ', '.join(lhs + [utils.quote(df[2])]))
+    request = 'SELECT {} SUM(`n`), MAX(`n`), COUNT(*) FROM ({})'.format(keys + ',' if keys else '', pairs)
+    request += ' GROUP BY ' + keys if keys else ''
+
+    return request + ' HAVING COUNT(*) > 1;'
+
+
+def _has_collation(c: sqlite3.Cursor, table: str) -> bool:
+    """Vrai si la définition de la table déclare une collation: SQLite ne compare plus comme Python"""
+    c.execute("SELECT `sql` FROM `sqlite_master` WHERE `type` = 'table' AND `name` = ?;", (table,))
+    row = c.fetchone()
+
+    return row is not None and row[0] is not None and 'COLLATE' in row[0].upper()
+
+
+def _changes_query(df: tuple) -> str:
+    """
+    Comme _violations_query, mais seuls les groupes de la prémisse qui
+    contiennent un tuple noté dans FuncDepLog sont examinés.
+    """
+    table = utils.quote(df[0])
+    lhs = [utils.quote(f) for f in df[1].split()]
+    rhs = utils.quote(df[2])
+
+    changed = 'SELECT DISTINCT {} FROM {} WHERE rowid IN (SELECT `row` FROM `FuncDepLog` WHERE `table` = ?)'.format(
+        ', '.join('{} AS g{}'.format(f, n) for n, f in enumerate(lhs)), table)
+    groups = 'SELECT {0} FROM ({1}) AS g JOIN {2} AS u ON {3} GROUP BY {0} HAVING {4} > 1'.format(
+        ', '.join('g.g{}'.format(n) for n in range(len(lhs))), changed, table,
+        ' AND '.join('u.{} IS g.g{}'.format(f, n) for n, f in enumerate(lhs)), _distinct_count('u.' + rhs))
+    join = ' AND '.join('t.{} IS v.g{}'.format(f, n) for n, f in enumerate(lhs))
+
+    return 'SELECT DISTINCT t.* FROM {} AS t JOIN ({}) AS v ON {} ORDER BY t.rowid;'.format(table, groups, join)
+
+
+# Table d'une décomposition planifiée: fields, attributes et dfs décrivent la nouvelle table,
+# rows et size sont les estimations du nombre de tuples et de la taille en octets
+PlannedTable = collections.namedtuple('PlannedTable', ['fields', 'attributes', 'dfs', 'source', 'name', 'keys',
+                                                       'rows', 'size'])
+
+# Plan de normalisation: il n'est valable que pour le schéma et les DF dont il a l'empreinte
+NormalizePlan = collections.namedtuple('NormalizePlan', ['tables', 'fingerprint'])
+
+
+def write_plan(plan: NormalizePlan, path: str):
+    with open(path, 'w') as file:
+        json.dump({'fingerprint': plan.fingerprint, 'tables': [t._asdict() for t in plan.tables]}, file, indent=2)
+
+
+def read_plan(path: str) -> NormalizePlan:
+    with open(path) as file:
+        content = json.load(file)
+
+    tables = [PlannedTable(**dict(t, fields=[tuple(f) for f in t['fields']], dfs=[tuple(df) for df in t['dfs']]))
+              for t in content['tables']]
+
+    return NormalizePlan(tables, content['fingerprint'])
+
+
+def _value_size(value) -> int:
+    """Taille approximative d'une valeur stockée par SQLite"""
+    if value is None:
+        return 1
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, bytes):
+        return len(value)
+
+    return 8
+
+
+def _wilson(hits: int, size: int, z: float = 1.96) -> tuple:
+    """Intervalle de confiance (Wilson) d'une proportion observée sur un échantillon"""
+    if size == 0:
+        return 0.0, 1.0
+
+    p = hits / size
+    d = 1 + z * z / size
+    centre = (p + z * z / (2 * size)) / d
+    margin = z * math.sqrt(p * (1 - p) / size + z * z / (4 * size * size)) / d
+
+    # Les arrondis ne doivent pas exclure la proportion observée
+    return max(0.0, min(p, centre - margin)), min(1.0, max(p, centre + margin))
+
+
+def _create_new_table(c: sqlite3.Cursor, nt: PlannedTable):
+    request = "CREATE TABLE IF NOT EXISTS `normalized`.`{}`(".format(nt.name)
+    fields = []
+
+    for field in nt[0]:
+        freq ="`{}` {}".format(field[1], field[2])
+        fields.append(freq)
+
+    request += functools.reduce(lambda a, b: a+','+b, fields) if len(fields) > 1 else fields[0]
+    request += ');'
+
+    c.execute(request)
+
+
+def _add_content(c: sqlite3.Cursor, nt: PlannedTable):
+    request = 'INSERT INTO `normalized`.{} SELECT DISTINCT {} FROM `main`.{};'.format(
+        utils.quote(nt.name), ', '.join(utils.quote(f) for f in nt[1]), utils.quote(nt.source))
+
+    c.execute(request)
+
+
+def _add_new_df(c: sqlite3.Cursor, nt: PlannedTable):
+    new_df = [(nt.name, df[1], df[2]) for df in nt[2]]
+    if len(new_df) > 0:
+        c.executemany('INSERT INTO `normalized`.`FuncDep` VALUES (?, ?, ?);', new_df)
+
+
+def _create_output(path: str):
+    """Crée une base de sortie vide, avec sa table FuncDep"""
+    conn = sqlite3.connect(path)
+    utils.execute_sql_file(conn.cursor(), os.path.join('misc', 'init_df_table.sql'))
+    conn.commit()
+    conn.close()
+
+
+@contextlib.contextmanager
+def _attached(c: sqlite3.Cursor, path: str, schema: str):
+    """Attache une base pour un chargement en masse: pas de journal ni de synchronisation"""
+    c.execute('ATTACH DATABASE ? AS {};'.format(utils.quote(schema)), (path,))
+
+    try:
+        c.execute('PRAGMA {}.journal_mode = OFF;'.format(utils.quote(schema)))
+        c.execute('PRAGMA {}.synchronous = OFF;'.format(utils.quote(schema)))
+        yield
+    finally:
+        c.execute('DETACH DATABASE {};'.format(utils.quote(schema)))
+
+
+def _normalize_worker(task: tuple) -> str:
+    """
+    Construit dans un processus séparé les tables décomposées d'une table
+    dans une base intermédiaire, en lisant la base d'origine en lecture seule.
+    """
+    uri, staging, tables = task
+    _create_output(staging)
+    conn = sqlite3.connect(uri, uri=True)
+
+    try:
+        c = conn.cursor()
+
+        with _attached(c, staging, 'normalized'):
+            c.execute('BEGIN;')
+            for nt in tables:
+                _create_new_table(c, nt)
+                _add_content(c, nt)
+                _add_new_df(c, nt)
+            conn.commit()
+
+        return staging
+    finally:
+        conn.close()
+
+
+def _check_df_worker(task: tuple) -> tuple:
+    """Vérifie une DF dans un processus séparé, sur une connexion en lecture seule"""
+    uri, df = task
+    conn = sqlite3.connect(uri, uri=True)
+
+    try:
+        c = conn.cursor()
+        c.execute(_violations_query(df))
+        return df, c.fetchall()
+    finally:
+        conn.close()
+
+
+def _timed(operation: str):
+    """Mesure la durée d'une méthode de DB quand l'instrumentation est active"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self._stats is None:
+                return method(self, *args, **kwargs)
+
+            with self._stats.timer(operation):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
 
 class DB:
     """
@@ -12,10 +298,62 @@ class DB:
     que l'on veut manipuler.
     """
 
-    def __init__(self, db_name: str):
+    _COMPILED_CACHE_SIZE = 16
+    _AUTO_INDEX_MIN_ROWS = 10000
+    _FAST_MAX_GROUPS = 100000
+
+    def __init__(self, db_name: str, instrument: bool = False, closure_cache_size: int = 4096):
         self._name = db_name
         self._path = os.path.abspath(self._name)
         self._conn = sqlite3.connect(self._path)
+        self._stats = None
+        self._tracemalloc = False
+        self._compiled = {}
+        self._schema_version = None
+        self._tables = None
+        self._fields = {}
+        self._dfs = None
+        self._data_version = None
+        self._closures = ClosureCache(closure_cache_size)
+
+        self.set_instrumentation(instrument)
+
+    def _cursor(self):
+        if self._stats is None:
+            return self._conn.cursor()
+
+        return InstrumentedCursor(self._conn.cursor(), self._stats)
+
+    def _timer(self, operation: str):
+        return self._stats.timer(operation) if self._stats is not None else contextlib.nullcontext()
+
+    def set_instrumentation(self, enabled: bool):
+        """
+        Active ou désactive la mesure des requêtes, de la durée des opérations
+        et du pic de mémoire (suivi par tracemalloc).
+        """
+        if enabled and self._stats is None:
+            self._stats = Stats()
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracemalloc = True
+
+        elif not enabled and self._stats is not None:
+            self._stats = None
+            if self._tracemalloc:
+                tracemalloc.stop()
+                self._tracemalloc = False
+
+    def stats(self) -> dict:
+        """Mesures collectées depuis l'activation de l'instrumentation"""
+        if self._stats is None:
+            return {}
+
+        return self._stats.as_dict()
+
+    def reset_stats(self):
+        if self._stats is not None:
+            self._stats.reset()
 
     @property
     def has_df_table(self):
@@ -26,12 +364,30 @@ class DB:
     def name(self) -> str:
         return self._name
 
+    @_timed('schema')
+    def _check_schema(self):
+        """Vide le cache du schéma si celui-ci a changé (même par une autre connexion)"""
+        c = self._cursor()
+        c.execute('PRAGMA schema_version')
+        version = c.fetchone()[0]
+
+        if version != self._schema_version:
+            self._schema_version = version
+            self._tables = None
+            self._fields = {}
+
     @property
     def tables(self) -> list:
-        c = self._conn.cursor()
-        c.execute('SELECT name FROM sqlite_master WHERE type="table";')
-        return [t[0] for t in c.fetchall()]
+        self._check_schema()
+
+        if self._tables is None:
+            c = self._cursor()
+            c.execute('SELECT name FROM sqlite_master WHERE type="table";')
+            self._tables = [t[0] for t in c.fetchall()]
 
+        return list(self._tables)
+
+    @_timed('schema')
     def get_fields(self, table: str) -> list:
 
         # La table doit exister
@@ -39,24 +395,32 @@ class DB:
             raise UnknownTableError()
 
         # La table n'est pas celle des DF
-        if table == 'FuncDep':
+        if table in _INTERNAL_TABLES:
             raise DFTableError()
 
-        c = self._conn.cursor()
-        c.execute('PRAGMA table_info(' + table + ')')
-        return [t[1] for t in c.fetchall()]
+        if table not in self._fields:
+            c = self._cursor()
+            c.execute('PRAGMA table_info(' + utils.quote(table) + ')')
+            self._fields[table] = [t[1] for t in c.fetchall()]
 
-    def add_df(self, table: str, lhs: str, rhs: str):
+        return list(self._fields[table])
+
+    def _validate_df(self, df: tuple, tables: set, fields: dict):
+        """Lève l'erreur correspondant à une DF invalide pour un instantané du schéma"""
+        table, lhs, rhs = df
 
         # La table doit exister
-        if table not in self.tables:
+        if table not in tables:
             raise UnknownTableError()
 
         # La table n'est pas celle des DF
-        if table == 'FuncDep':
+        if table in _INTERNAL_TABLES:
             raise DFTableError()
 
-        table_fields = self.get_fields(table)
+        if table not in fields:
+            fields[table] = set(self.get_fields(table))
+
+        table_fields = fields[table]
 
         # Tous les champs de la prémisse existent dans la table
         for field in lhs.split():
@@ -68,24 +432,113 @@ class DB:
             raise DFNotSingularError()
 
         # Le champ de déffini doit exister dans la table
-        if rhs not in self.get_fields(table):
+        if rhs not in table_fields:
             raise UnknownFieldsError()
 
         # Le champ rhs ne doit pas être dans les champs lhs
         if rhs in lhs.split():
             raise RHSIncludeToLHSError()
 
-        c = self._conn.cursor()
-
+    def _create_df_table(self, c):
         # On crée la tables des DF si besoin
         if not self.has_df_table:
             utils.execute_sql_file(c, os.path.join('misc', 'init_df_table.sql'))
 
+    def add_df(self, table: str, lhs: str, rhs: str):
+        self._validate_df((table, lhs, rhs), set(self.tables), {})
+
+        c = self._cursor()
+        self._create_df_table(c)
+
         try:
             c.execute('INSERT INTO `FuncDep` VALUES (?, ?, ?)', (table, lhs, rhs))
         except sqlite3.IntegrityError:
             raise DFAddTwiceError()
 
+        self._df_set().add((table, lhs, rhs))
+        self._invalidate_cache([table])
+
+    def add_dfs(self, dfs):
+        """
+        Ajoute un lot de DF en une seule transaction. Tout le lot est validé
+        sur un même instantané du schéma; s'il contient des DF invalides,
+        aucune n'est ajoutée et DFBatchError les donne toutes.
+        """
+        tables = set(self.tables)
+        fields = {}
+        known = self._df_set()
+        batch = []
+        batch_set = set()
+        errors = []
+
+        for n, df in enumerate(dfs):
+            df = tuple(df)
+
+            try:
+                self._validate_df(df, tables, fields)
+                if df in known or df in batch_set:
+                    raise DFAddTwiceError()
+            except (UnknownTableError, DFTableError, UnknownFieldsError, DFNotSingularError,
+                    RHSIncludeToLHSError, DFAddTwiceError) as error:
+                errors.append((n, df, error))
+                continue
+
+            batch.append(df)
+            batch_set.add(df)
+
+        if errors:
+            raise DFBatchError(errors)
+
+        with self._conn:
+            c = self._cursor()
+            self._create_df_table(c)
+            c.executemany('INSERT INTO `FuncDep` VALUES (?, ?, ?)', batch)
+
+        dfs = self._df_set()
+        for df in batch:
+            dfs.add(df)
+
+        self._invalidate_cache({df[0] for df in batch})
+
+    def import_dfs(self, path: str):
+        """Ajoute les DF d'un fichier CSV ou JSON (voir utils.read_df_file)"""
+        self.add_dfs(utils.read_df_file(path))
+
+    def export_dfs(self, path: str = None, table: str = None) -> list:
+        """Renvoie les DF (d'une table) et les écrit dans un fichier CSV ou JSON si demandé"""
+        dfs = self.list_table_df(table) if table is not None else self.list_df()
+
+        if path is not None:
+            utils.write_df_file(path, dfs)
+
+        return dfs
+
+    @_timed('discover')
+    def discover_df(self, table: str, max_lhs: int = None) -> list:
+        """
+        Cherche les DF minimales vérifiées par les données de la table et
+        les ajoute à la table des DF. Renvoie la liste des DF trouvées. Une
+        colonne constante (DF de prémisse vide) n'est pas retenue.
+        """
+        fields = self.get_fields(table)
+        columns = funcdep_discover.read_columns(self._cursor(), table, fields)
+        res = []
+
+        for lhs, rhs in funcdep_discover.tane(columns, max_lhs):
+            # Les commandes et l'analyse des formes normales attendent une prémisse
+            if lhs == 0:
+                continue
+
+            df = (table, utils.list2str([f for n, f in enumerate(fields) if lhs >> n & 1]), fields[rhs])
+            res.append(df)
+
+            try:
+                self.add_df(*df)
+            except DFAddTwiceError:
+                pass
+
+        return res
+
     def del_df(self, table: str, lhs: str, rhs: str):
         df =  (table, lhs, rhs)
 
@@ -94,103 +547,713 @@ class DB:
             raise UnknownTableError()
 
         # La DF doit exister
-        if df not in self.list_df():
+        if df not in self._df_set():
             raise DFNotFoundError()
 
-        c = self._conn.cursor()
+        c = self._cursor()
 
         c.execute('DELETE FROM `FuncDep` WHERE `table` = ? AND `lhs` = ? AND `rhs` = ?', df)
+        self._df_set().remove(df)
+        self._invalidate_cache([table])
+
+    def _df_set(self) -> 'FDSet':
+        """
+        DF de la base gardées en mémoire. Elles sont relues quand une autre
+        connexion a modifié la base (PRAGMA data_version).
+        """
+        c = self._cursor()
+        c.execute('PRAGMA data_version')
+        version = c.fetchone()[0]
+
+        if self._dfs is None or version != self._data_version:
+            self._data_version = version
+            rows = []
+
+            if self.has_df_table:
+                c.execute('SELECT * FROM `FuncDep`')
+                rows = c.fetchall()
+
+            self._dfs = FDSet(rows)
+
+        return self._dfs
 
     def list_df(self) -> list:
-        c = self._conn.cursor()
+        return self._df_set().rows()
 
+    def list_table_df(self, table: str) -> list:
         # La table doit exister
-        if not self.has_df_table:
+        if table not in self.tables:
+            raise UnknownTableError()
+
+        # Même ordre que la lecture de FuncDep par sa clef primaire
+        return sorted(self._df_set().rows(table))
+
+    def purge_df(self):
+        c = self._cursor()
+        c.execute('DELETE FROM `FuncDep`')
+        self._df_set().clear()
+        self._invalidate_cache()
+
+    def _df_weight(self, df: tuple) -> int:
+        """Estimation du coût de la vérification d'une DF (nombre de tuples)"""
+        c = self._cursor()
+
+        try:
+            c.execute('SELECT MAX(rowid) FROM {};'.format(utils.quote(df[0])))
+        except sqlite3.OperationalError:
+            c.execute('SELECT COUNT(*) FROM {};'.format(utils.quote(df[0])))
+
+        return c.fetchone()[0] or 0
+
+    def _lhs_indexed(self, table: str, lhs: list, rhs: str = None) -> bool:
+        """
+        True si un index de la table commence par les champs de la prémisse
+        (suivis du champ rhs s'il est donné)
+        """
+        c = self._cursor()
+        c.execute('PRAGMA index_list({});'.format(utils.quote(table)))
+
+        for index in c.fetchall():
+            # Les index partiels ne couvrent pas toute la table
+            if index[4]:
+                continue
+
+            c.execute('PRAGMA index_info({});'.format(utils.quote(index[1])))
+            columns = [t[2] for t in sorted(c.fetchall())]
+
+            if set(columns[:len(lhs)]) == set(lhs) and (rhs is None or columns[len(lhs):len(lhs) + 1] == [rhs]):
+                return True
+
+        return False
+
+    @contextlib.contextmanager
+    def _temporary_indexes(self, dfs: list):
+        """
+        Crée le temps d'une vérification un index couvrant (prémisse, champs
+        déterminés) pour les prémisses qui n'en ont pas, si la table est assez
+        grande pour que le tri de l'index coûte moins que les parcours évités.
+        """
+        groups = {}
+        for df in dfs:
+            groups.setdefault((df[0], df[1]), []).append(df[2])
+
+        c = self._cursor()
+        created = []
+
+        try:
+            for n, ((table, lhs), rhs) in enumerate(groups.items()):
+                lhs = lhs.split()
+
+                if not lhs or self._lhs_indexed(table, lhs):
+                    continue
+                if self._df_weight((table, lhs, rhs)) < self._AUTO_INDEX_MIN_ROWS:
+                    continue
+
+                name = utils.quote('funcdep_tmp_{}_{}'.format(table, n))
+                columns = ', '.join(utils.quote(f) for f in lhs + list(dict.fromkeys(rhs)))
+
+                try:
+                    c.execute('CREATE INDEX IF NOT EXISTS {} ON {}({});'.format(name, utils.quote(table), columns))
+                except sqlite3.OperationalError:
+                    # Base en lecture seule: on vérifie sans index
+                    continue
+
+                created.append(name)
+
+            yield
+        finally:
+            for name in created:
+                c.execute('DROP INDEX IF EXISTS {};'.format(name))
+
+    def _first_violation(self, df: tuple) -> list:
+        """
+        Lit la table jusqu'au premier conflit et renvoie les deux tuples qui
+        violent la DF. Aucun tri ni index: le coût dépend de la position du
+        premier conflit et pas de la taille de la table. Au-delà de
+        _FAST_MAX_GROUPS valeurs de la prémisse gardées en mémoire, ou si la
+        table déclare une collation, c'est un GROUP BY de SQLite qui cherche un
+        groupe en violation.
+        """
+        c = self._cursor()
+        pair = None
+
+        # Les valeurs sont comparées selon la collation déclarée: seul SQLite sait le faire
+        seen = None if _has_collation(c, df[0]) else {}
+
+        if seen is not None:
+            fields = df[1].split() + [df[2]]
+            c.execute('SELECT rowid, {} FROM {};'.format(', '.join(utils.quote(f) for f in fields),
+                                                        utils.quote(df[0])))
+
+            with contextlib.closing(c):
+                for row in c:
+                    first = seen.setdefault(row[1:-1], (row[0], row[-1]))
+
+                    if first[1] != row[-1]:
+                        pair = (first[0], row[0])
+                        break
+
+                    if len(seen) > self._FAST_MAX_GROUPS:
+                        seen = None
+                        break
+
+            c = self._cursor()
+
+        if seen is None:
+            c.execute(_groups_query(df, 1))
+            group = c.fetchone()
+
+            if group is not None:
+                # Deux tuples du groupe qui n'ont pas la même valeur du champ déterminé, comparées par SQLite
+                table, rhs, condition = utils.quote(df[0]), utils.quote(df[2]), _group_condition(df)
+                c.execute('SELECT rowid, {} FROM {} WHERE {} ORDER BY rowid LIMIT 1;'.format(rhs, table, condition),
+                          group[:-2])
+                first = c.fetchone()
+                c.execute('SELECT rowid FROM {} WHERE {} AND {} IS NOT ? ORDER BY rowid LIMIT 1;'.format(
+                    table, condition, rhs), group[:-2] + first[1:])
+                pair = (first[0], c.fetchone()[0])
+
+        if pair is None:
             return []
-        
-        c.execute('SELECT * FROM `FuncDep`')
+
+        c.execute('SELECT * FROM {} WHERE rowid IN (?, ?) ORDER BY rowid;'.format(utils.quote(df[0])), pair)
         return c.fetchall()
 
-    def list_table_df(self, table: str) -> list:
+    @_timed('check')
+    def _check_df_set(self, dfs: list, jobs: int = 1, auto_index: bool = True, fast: bool = False,
+                      engine: str = 'sql') -> dict:
+        if engine not in ENGINES:
+            raise ValueError('unknown engine: ' + engine)
+
+        if fast:
+            return {df: self._first_violation(df) for df in dfs}
+
+        if engine == 'numpy':
+            return self._check_df_set_numpy(dfs)
+
+        with self._temporary_indexes(dfs if auto_index else []):
+            if jobs > 1 and len(dfs) > 1:
+                return self._check_df_set_parallel(dfs, jobs)
+
+            c = self._cursor()
+            res = {}
+
+            for df in dfs:
+                c.execute(_violations_query(df))
+                res[df] = c.fetchall()
+
+            return res
+
+    def _check_df_set_numpy(self, dfs: list) -> dict:
+        """Vérifie les DF table par table, chaque table n'étant lue qu'une fois"""
+        if funcdep_numpy is None:
+            raise EngineUnavailableError('numpy')
+
+        by_table = {}
+        for df in dfs:
+            by_table.setdefault(df[0], []).append(df)
+
+        c = self._cursor()
+        res = {}
+
+        for table, table_dfs in by_table.items():
+            if not _has_collation(c, table):
+                res.update(funcdep_numpy.check_table(c, table, table_dfs))
+                continue
+
+            # Les valeurs sont comparées selon la collation déclarée: seul SQL sait le faire
+            for df in table_dfs:
+                c.execute(_violations_query(df))
+                res[df] = c.fetchall()
+
+        return {df: res[df] for df in dfs}
+
+    def _check_df_set_parallel(self, dfs: list, jobs: int) -> dict:
+        # Les processus ouvrent leur propre connexion: ils doivent voir les DF ajoutées
+        self._conn.commit()
+
+        weights = {df: self._df_weight(df) for df in dfs}
+        heavy_first = sorted(dfs, key=lambda df: -weights[df])
+        uri = pathlib.Path(self._path).as_uri() + '?mode=ro'
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            found = dict(executor.map(_check_df_worker, [(uri, df) for df in heavy_first]))
+
+        return {df: found[df] for df in dfs}
+
+    def iter_violations(self, table: str = None, limit_per_df: int = None, summary: bool = True, sample_size: int = 5,
+                        auto_index: bool = True):
+        """
+        Produit au fur et à mesure un résumé (Violation) de chaque groupe de la
+        prémisse qui viole une DF. L'échantillon contient quelques rowid du
+        groupe, ou tous ses tuples distincts si summary est faux.
+        """
+        if table is not None and table not in self.tables:
+            raise UnknownTableError()
+
+        dfs = self.list_table_df(table) if table is not None else self.list_df()
+        groups = self._cursor()
+        c = self._cursor()
+
+        with self._temporary_indexes(dfs if auto_index else []), contextlib.closing(groups):
+            for df in dfs:
+                condition = _group_condition(df)
+                groups.execute(_groups_query(df, limit_per_df))
+
+                for group in groups:
+                    lhs = group[:-2]
+
+                    if summary:
+                        c.execute('SELECT rowid FROM {} WHERE {} LIMIT ?;'.format(utils.quote(df[0]), condition),
+                                  lhs + (sample_size,))
+                        sample = [t[0] for t in c.fetchall()]
+                    else:
+                        c.execute('SELECT DISTINCT * FROM {} WHERE {};'.format(utils.quote(df[0]), condition), lhs)
+                        sample = c.fetchall()
+
+                    yield Violation(df, lhs, group[-2], group[-1], sample)
+
+    def check_df(self, jobs: int = 1, auto_index: bool = True, fast: bool = False, engine: str = 'sql') -> dict:
+        """
+        Vérifie si les DF sont respectées (sur jobs processus). En mode fast,
+        seuls les deux premiers tuples en conflit sont renvoyés pour chaque DF.
+        Le moteur 'numpy' lit chaque table une seule fois pour toutes ses DF.
+        """
+        return self._check_df_set(self.list_df(), jobs, auto_index, fast, engine)
+
+    def check_table_df(self, table: str, jobs: int = 1, auto_index: bool = True, fast: bool = False,
+                       engine: str = 'sql') -> dict:
+        """
+        Vérifie si les DF sont respectées (sur jobs processus). En mode fast,
+        seuls les deux premiers tuples en conflit sont renvoyés pour chaque DF.
+        Le moteur 'numpy' lit la table une seule fois pour toutes ses DF.
+        """
+
         # La table doit exister
         if table not in self.tables:
             raise UnknownTableError()
 
-        c = self._conn.cursor()
+        return self._check_df_set(self.list_table_df(table), jobs, auto_index, fast, engine)
 
-        if not self.has_df_table:
+    def _sample_rows(self, table: str, size: int, rand: random.Random) -> list:
+        """
+        Tire au plus size tuples au hasard (avec leur rowid) en cherchant des
+        rowid aléatoires: chaque tirage est une recherche dans l'arbre de la
+        table et ne la parcourt pas.
+        """
+        c = self._cursor()
+        c.execute('SELECT MAX(rowid) FROM {};'.format(utils.quote(table)))
+        last = c.fetchone()[0]
+
+        if last is None:
             return []
-        
-        c.execute('SELECT * FROM `FuncDep` WHERE `table` = ?', (table,))
-        return c.fetchall()
 
-    def purge_df(self):
-        c = self._conn.cursor()
-        c.execute('DELETE FROM `FuncDep`')
+        if last <= size:
+            c.execute('SELECT rowid, * FROM {};'.format(utils.quote(table)))
+            return c.fetchall()
+
+        rows = {}
+
+        # Les rowid supprimés ne donnent rien: on retire quelques fois les manquants
+        for _ in range(10):
+            candidates = list({rand.randint(1, last) for _ in range(size - len(rows))} - rows.keys())
+
+            for n in range(0, len(candidates), 500):
+                chunk = candidates[n:n + 500]
+                c.execute('SELECT rowid, * FROM {} WHERE rowid IN ({});'.format(
+                    utils.quote(table), ', '.join('?' for _ in chunk)), chunk)
+                rows.update((t[0], t) for t in c.fetchall())
+
+            if len(rows) >= size:
+                break
+
+        return list(rows.values())
+
+    @_timed('check')
+    def sample_df(self, size: int, table: str = None, seed: int = None) -> dict:
+        """
+        Vérifie les DF sur size tuples tirés au hasard. Si la table a un index
+        sur (prémisse, champ déterminé), le groupe de chaque tuple tiré est
+        vérifié dans toute la table et l'intervalle estime la proportion de
+        tuples de la table en violation. Sinon (ou si la table déclare une
+        collation) les tuples ne sont comparés qu'entre eux: une violation
+        trouvée est sûre mais l'intervalle ne porte que sur les conflits
+        visibles dans un échantillon de cette taille.
+        """
+        if table is not None and table not in self.tables:
+            raise UnknownTableError()
 
-    def _check_df_set(self, dfs: list) -> dict:
-        c = self._conn.cursor()
+        dfs = self.list_table_df(table) if table is not None else self.list_df()
+        rand = random.Random(seed)
+        samples = {}
+        collated = {}
+        c = self._cursor()
         res = {}
 
         for df in dfs:
-            unique_lhs = c.execute('SELECT DISTINCT ' + df[1].replace(' ', ', ') + ' FROM ' + df[0] + ';') 
+            if df[0] not in samples:
+                samples[df[0]] = self._sample_rows(df[0], size, rand)
+                collated[df[0]] = _has_collation(c, df[0])
+
+            rows = samples[df[0]]
+            fields = self.get_fields(df[0])
+            lhs = df[1].split()
+            positions = [fields.index(f) + 1 for f in lhs]
+            rhs = fields.index(df[2]) + 1
+            probed = not collated[df[0]] and self._lhs_indexed(df[0], lhs, df[2])
+            bad = []
+
+            if collated[df[0]]:
+                # Les valeurs sont comparées selon la collation déclarée: SQLite groupe les tuples tirés
+                sampled = 'rowid IN ({})'.format(', '.join(str(row[0]) for row in rows))
+                c.execute(_groups_query(df, where=sampled))
+                found = set()
+
+                for group in c.fetchall():
+                    c.execute('SELECT rowid FROM {} WHERE {} AND {};'.format(
+                        utils.quote(df[0]), sampled, _group_condition(df)), group[:-2])
+                    found.update(t[0] for t in c.fetchall())
+
+                bad = [row[1:] for row in rows if row[0] in found]
+            elif probed:
+                # Plus petite et plus grande valeur du champ déterminé dans le groupe, lues dans l'index
+                query = 'SELECT (SELECT {1} FROM {0} WHERE {2} ORDER BY {1} LIMIT 1), ' \
+                        '(SELECT {1} FROM {0} WHERE {2} ORDER BY {1} DESC LIMIT 1);'.format(
+                            utils.quote(df[0]), utils.quote(df[2]), _group_condition(df))
+
+                for row in rows:
+                    lhs_values = tuple(row[p] for p in positions)
+                    c.execute(query, lhs_values + lhs_values)
+                    low, high = c.fetchone()
+
+                    if low != high:
+                        bad.append(row[1:])
+            else:
+                values = {}
+                for row in rows:
+                    values.setdefault(tuple(row[p] for p in positions), set()).add(row[rhs])
+
+                bad = [row[1:] for row in rows if len(values[tuple(row[p] for p in positions)]) > 1]
+
+            res[df] = Sample(df, len(rows), len(bad), bad, *_wilson(len(bad), len(rows)), probed)
 
-            for lhs in unique_lhs:
-                conditions_list = ['{}={}'.format(f, v.__repr__()) for f, v in zip(df[1].split(), lhs)]
-                conditions = functools.reduce(lambda a, b : a + ' AND ' + b, conditions_list)
+        return res
 
-                c.execute('SELECT DISTINCT {} FROM {} WHERE {};'.format(df[2], df[0], conditions))
-                assos = c.fetchall()
+    @_timed('check')
+    def df_error(self, table: str, worst: int = 5, batch: int = 10000) -> dict:
+        """
+        Mesure g3 de chaque DF d'une table: la proportion minimale de tuples à
+        supprimer pour que la DF soit respectée (dans chaque groupe de la
+        prémisse, on garde la valeur la plus fréquente du champ déterminé).
+        Toutes les DF sont mesurées en une seule lecture de la table: les
+        couples (prémisse, valeur) sont comptés au fil des lots de tuples, les
+        DF de même prémisse partagent le calcul de la prémisse. Si la table
+        déclare une collation, chaque DF est mesurée par un GROUP BY de SQLite.
+        """
+        if table not in self.tables:
+            raise UnknownTableError()
 
-                res[df] = [t for t in c.execute('SELECT DISTINCT * FROM {} WHERE {};'.format(df[0], conditions))] \
-                    if len(assos) > 1 else []
+        dfs = self.list_table_df(table)
+
+        if dfs and _has_collation(self._cursor(), table):
+            return self._df_error_sql(table, dfs, worst)
+
+        fields = list(dict.fromkeys(f for df in dfs for f in df[1].split() + [df[2]]))
+        position = {f: n for n, f in enumerate(fields)}
+        by_lhs = {}
+
+        for df in dfs:
+            by_lhs.setdefault(df[1], []).append(df)
+
+        # Pour chaque prémisse: de quoi lire ses valeurs, et pour chacune de ses DF le champ déterminé et les comptes
+        plan = [(operator.itemgetter(*[position[f] for f in lhs.split()]) if lhs else (lambda row: ()),
+                 [(df, operator.itemgetter(position[df[2]]), collections.Counter()) for df in group])
+                for lhs, group in by_lhs.items()]
+        n_rows = 0
+
+        if dfs:
+            c = self._cursor()
+            c.execute('SELECT {} FROM {};'.format(', '.join(utils.quote(f) for f in fields), utils.quote(table)))
+
+            with contextlib.closing(c):
+                rows = c.fetchmany(batch)
+
+                while rows:
+                    n_rows += len(rows)
+
+                    for lhs_values, group in plan:
+                        keys = list(map(lhs_values, rows))
+                        for df, rhs_value, pairs in group:
+                            pairs.update(zip(keys, map(rhs_value, rows)))
+
+                    rows = c.fetchmany(batch)
+
+        res = {}
+
+        for lhs_values, group in plan:
+            for df, rhs_value, pairs in group:
+                groups = {}
+
+                # [tuples, tuples de la valeur la plus fréquente, valeurs] par groupe de la prémisse
+                for (key, value), count in pairs.items():
+                    g = groups.setdefault(key, [0, 0, 0])
+                    g[0] += count
+                    g[1] = max(g[1], count)
+                    g[2] += 1
+
+                single = len(df[1].split()) == 1
+                bad = [ErrorGroup((key,) if single else key, g[0], g[2], g[0] - g[1])
+                       for key, g in groups.items() if g[2] > 1]
+                removed = sum(g.removed for g in bad)
+
+                res[df] = DFError(df, n_rows, removed, removed / n_rows if n_rows else 0.0, len(bad),
+                                  heapq.nlargest(worst, bad, key=lambda g: (g.removed, g.count)))
+
+        return {df: res[df] for df in dfs}
+
+    def _df_error_sql(self, table: str, dfs: list, worst: int) -> dict:
+        """df_error par SQL: les valeurs sont comparées selon la collation déclarée"""
+        c = self._cursor()
+        c.execute('SELECT COUNT(*) FROM {};'.format(utils.quote(table)))
+        n_rows = c.fetchone()[0]
+        res = {}
+
+        for df in dfs:
+            c.execute(_error_groups_query(df))
+            bad = [ErrorGroup(g[:-3], g[-3], g[-1], g[-3] - g[-2]) for g in c.fetchall()]
+            removed = sum(g.removed for g in bad)
+
+            res[df] = DFError(df, n_rows, removed, removed / n_rows if n_rows else 0.0, len(bad),
+                              heapq.nlargest(worst, bad, key=lambda g: (g.removed, g.count)))
 
         return res
 
-    def check_df(self) -> dict:
-        """Vérifie si les DF sont respectées"""
-        return self._check_df_set(self.list_df())
+    def _sql_string(self, value: str) -> str:
+        return "'" + value.replace("'", "''") + "'"
 
-    def check_table_df(self, table: str) -> dict:
-        """Vérifie si les DF sont respectées"""
+    def incremental_tables(self) -> list:
+        """Tables dont les modifications sont enregistrées dans FuncDepLog"""
+        c = self._cursor()
+        c.execute('SELECT DISTINCT tbl_name FROM sqlite_master WHERE type = "trigger" AND name LIKE "funcdep_log_%";')
+        return [t[0] for t in c.fetchall()]
 
-        # La table doit exister
-        if table not in self.tables:
+    def enable_incremental(self, table: str = None):
+        """
+        Installe sur une table (par défaut celles qui ont des DF) des
+        déclencheurs qui notent les tuples insérés ou modifiés, ainsi qu'un
+        index par prémisse, pour que check_changes ne relise que les groupes
+        touchés. Une suppression ne peut pas créer de violation: elle n'est
+        pas enregistrée. Le premier check_changes vérifie toute la table, de
+        même pour une DF ajoutée ensuite. À relancer après l'ajout de DF sur
+        une nouvelle prémisse, pour son index.
+        """
+        if table is not None and table not in self.tables:
             raise UnknownTableError()
 
-        return self._check_df_set(self.list_table_df(table))
+        tables = [table] if table is not None else list(self._dfs_by_table())
+        c = self._cursor()
 
-    def _is_include(self, sub: list, lset: list) -> bool:
-        for e in sub:
-            if e not in lset:
-                return False
-        
-        return True
+        utils.execute_sql_file(c, os.path.join('misc', 'init_df_log.sql'))
 
-    def df_closure(self, attributes: str, dfs: list) -> list:
-        res = attributes.split()
-        res_has_changed = True
-        dfs = copy.deepcopy(dfs)
-        next_dfs = copy.deepcopy(dfs)
+        for t in tables:
+            if t in _INTERNAL_TABLES:
+                raise DFTableError()
+
+            for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW')):
+                c.execute('CREATE TRIGGER IF NOT EXISTS {} AFTER {} ON {} BEGIN '
+                          'INSERT OR IGNORE INTO `FuncDepLog` VALUES ({}, {}.rowid); END;'.format(
+                              utils.quote('funcdep_log_{}_{}'.format(t, event.lower())), event, utils.quote(t),
+                              self._sql_string(t), row))
 
-        while res_has_changed:
-            res_has_changed = False
-            dfs = copy.deepcopy(next_dfs)
+            for lhs in dict.fromkeys(df[1] for df in self._dfs_by_table().get(t, [])):
+                if lhs and not self._lhs_indexed(t, lhs.split()):
+                    c.execute('CREATE INDEX IF NOT EXISTS {} ON {}({});'.format(
+                        utils.quote('funcdep_inc_{}_{}'.format(t, lhs.replace(' ', '_'))), utils.quote(t),
+                        ', '.join(utils.quote(f) for f in lhs.split())))
 
+        self._conn.commit()
+
+    def disable_incremental(self, table: str = None):
+        """Retire les déclencheurs et index du mode incrémental et oublie les modifications notées"""
+        tables = [table] if table is not None else self.incremental_tables()
+        c = self._cursor()
+
+        for t in tables:
+            c.execute('SELECT type, name FROM sqlite_master WHERE tbl_name = ? AND '
+                      '(name LIKE "funcdep_log_%" OR name LIKE "funcdep_inc_%");', (t,))
+
+            for kind, name in c.fetchall():
+                c.execute('DROP {} IF EXISTS {};'.format(kind.upper(), utils.quote(name)))
+
+            if 'FuncDepLog' in self.tables:
+                c.execute('DELETE FROM `FuncDepLog` WHERE `table` = ?;', (t,))
+
+            if 'FuncDepChecked' in self.tables:
+                c.execute('DELETE FROM `FuncDepChecked` WHERE `table` = ?;', (t,))
+
+        self._conn.commit()
+
+    @_timed('check')
+    def check_changes(self, table: str = None) -> dict:
+        """
+        Vérifie les DF comme check_df, mais sur une table en mode incrémental
+        seuls les groupes de la prémisse touchés depuis la dernière
+        vérification sont relus. Les autres tables, et les DF qui n'ont pas
+        encore été vérifiées entièrement (FuncDepChecked), le sont entièrement.
+        """
+        if table is not None and table not in self.tables:
+            raise UnknownTableError()
+
+        dfs = self.list_table_df(table) if table is not None else self.list_df()
+        incremental = set(self.incremental_tables())
+        c = self._cursor()
+        res = {}
+
+        checked = set()
+        if 'FuncDepChecked' in self.tables:
+            c.execute('SELECT `table`, `lhs`, `rhs` FROM `FuncDepChecked`;')
+            checked = set(c.fetchall())
+
+        # Aucune écriture ne doit se glisser entre la vérification et le vidage du journal
+        self._conn.commit()
+        c.execute('BEGIN IMMEDIATE;')
+
+        try:
             for df in dfs:
+                if df[0] in incremental and df[1] and df in checked:
+                    c.execute(_changes_query(df), (df[0],))
+                else:
+                    c.execute(_violations_query(df))
+                res[df] = c.fetchall()
+
+            for t in incremental & {df[0] for df in dfs}:
+                c.execute('DELETE FROM `FuncDepLog` WHERE `table` = ?;', (t,))
+
+                # Les DF de la table sont à jour: seules les modifications seront relues la prochaine fois
+                c.execute('DELETE FROM `FuncDepChecked` WHERE `table` = ?;', (t,))
+                c.executemany('INSERT INTO `FuncDepChecked` VALUES (?, ?, ?);', [df for df in dfs if df[0] == t])
+
+            self._conn.commit()
+        except Exception:
+            self._conn.rollback()
+            raise
+
+        return res
+
+    def _compile(self, dfs: list) -> tuple:
+        """
+        Renvoie la représentation compilée d'une liste de DF (mémorisée) et
+        le numéro de version qui identifie la liste dans le cache des fermetures
+        """
+        key = tuple(dfs)
+        compiled = self._compiled.get(key)
+
+        if compiled is None:
+            if len(self._compiled) >= self._COMPILED_CACHE_SIZE:
+                self._compiled.clear()
+            compiled = CompiledDFs(dfs), next(_VERSIONS)
+            self._compiled[key] = compiled
+
+        return compiled
+
+    def _closure(self, table: str, version: int, compiled: 'CompiledDFs', attributes: list) -> list:
+        """Fermeture passée par le cache, les attributs donnés en premier"""
+        res = list(dict.fromkeys(attributes))
+        mask = compiled.mask(res)
+
+        return res + compiled.names(self._closures.closure_mask(table, version, compiled, mask) & ~mask)
+
+    def table_closure(self, table: str, attributes: str) -> list:
+        """Fermeture d'attributs par les DF d'une table"""
+        dfs = self._df_set()
+        return self._closure(table, dfs.version(table), dfs.compiled(table), attributes.split())
 
-                lhs = df[1].split()
+    def closure_cache_info(self) -> dict:
+        """Succès et échecs du cache des fermetures, pour en choisir la taille"""
+        return self._closures.info()
 
-                if self._is_include(lhs, res):
-                    next_dfs.remove(df)
-                    if df[2] not in res: 
-                        res_has_changed = True
-                        res.append(df[2])
+    @_timed('closure')
+    def df_closure(self, attributes: str, dfs: list) -> list:
+        compiled, version = self._compile(dfs)
+        return self._closure(None, version, compiled, attributes.split())
+
+    def _table_fingerprint(self, table: str) -> str:
+        """Empreinte des champs et des DF d'une table"""
+        content = [self.get_fields(table), sorted(self._df_set().rows(table))]
+        return hashlib.sha1(json.dumps(content).encode()).hexdigest()
+
+    def _invalidate_cache(self, tables: list = None):
+        """Oublie les analyses gardées dans FuncDepCache (de toutes les tables si tables est None)"""
+        if 'FuncDepCache' not in self.tables:
+            return
+
+        c = self._cursor()
+        if tables is None:
+            c.execute('DELETE FROM `FuncDepCache`;')
+        else:
+            c.executemany('DELETE FROM `FuncDepCache` WHERE `table` = ?;', [(t,) for t in tables])
+
+    def _cached(self, table: str, kind: str, compute):
+        """
+        Résultat d'une analyse lu dans FuncDepCache s'il a été calculé pour
+        les mêmes champs et les mêmes DF, sinon calculé puis enregistré (et
+        validé tout de suite pour ne pas garder la base verrouillée). Si une
+        transaction est en cours, le résultat n'est pas enregistré: le valider
+        validerait aussi les modifications de l'appelant. Les valeurs passent
+        par JSON: les tuples reviennent sous forme de listes.
+        """
+        if table in _INTERNAL_TABLES or table not in self.tables:
+            return compute()
+
+        fingerprint = self._table_fingerprint(table)
+        c = self._cursor()
+
+        if 'FuncDepCache' in self.tables:
+            c.execute('SELECT `fingerprint`, `value` FROM `FuncDepCache` WHERE `table` = ? AND `kind` = ?;',
+                      (table, kind))
+            row = c.fetchone()
+
+            if row is not None and row[0] == fingerprint:
+                return json.loads(row[1])
+
+        res = compute()
+
+        if self._conn.in_transaction:
+            return res
+
+        try:
+            if 'FuncDepCache' not in self.tables:
+                utils.execute_sql_file(c, os.path.join('misc', 'init_df_cache.sql'))
+
+            c.execute('INSERT OR REPLACE INTO `FuncDepCache` VALUES (?, ?, ?, ?);',
+                      (table, kind, fingerprint, json.dumps(res)))
+            self._conn.commit()
+        except sqlite3.OperationalError:
+            # Base en lecture seule ou verrouillée: le résultat n'est simplement pas gardé
+            self._conn.rollback()
 
         return res
 
+    def load_sql_file(self, path: str, batch: int = 1000, progress=None) -> int:
+        """
+        Exécute un script SQL (un dump par exemple) lu en flux, validé par
+        lots de batch instructions. Renvoie le nombre d'instructions.
+        """
+        self._conn.commit()
+
+        try:
+            return utils.execute_sql_file(self._cursor(), path, batch, progress)
+        finally:
+            # Le script a pu modifier FuncDep sur cette connexion: data_version ne le signale pas
+            self._dfs = None
+            self._closures.clear()
+
+    def _dfs_by_table(self) -> dict:
+        dfs = self._df_set()
+        return {table: dfs.rows(table) for table in dfs.tables()}
+
     def is_df_useless(self, check_df: tuple) -> bool:
-        dfs = self.list_df()
+        dfs = self._dfs_by_table().get(check_df[0], [])
 
         if check_df in dfs:
             dfs.remove(check_df)
@@ -202,124 +1265,185 @@ class DB:
     def find_useless_df(self) -> list:
         res = []
 
-        for df in self.list_df():
-            if self.is_df_useless(df):
-                res.append(df)
+        for table, dfs in self._dfs_by_table().items():
+            compiled = self._df_set().compiled(table)
+
+            for n, df in enumerate(dfs):
+                if compiled.closure_mask(compiled.mask(df[1].split()), {n}) & compiled.mask([df[2]]):
+                    res.append(df)
 
         return res
 
+    def _cover(self, dfs: list, reduce_lhs: bool) -> list:
+        compiled = CompiledDFs(dfs)
+        res = []
+
+        # Retrait des attributs superflus de la prémisse
+        for df in dfs:
+            lhs = df[1].split()
+            rhs = compiled.mask([df[2]])
+
+            if reduce_lhs:
+                for att in list(lhs):
+                    reduced = [a for a in lhs if a != att]
+                    if compiled.closure_mask(compiled.mask(reduced)) & rhs:
+                        lhs = reduced
+
+            res.append((df[0], utils.list2str(lhs), df[2]))
+
+        res = list(dict.fromkeys(res))
+
+        # Retrait des DF redondantes
+        compiled = CompiledDFs(res)
+        removed = set()
+
+        for n, df in enumerate(res):
+            if compiled.closure_mask(compiled.mask(df[1].split()), removed | {n}) & compiled.mask([df[2]]):
+                removed.add(n)
+
+        return [df for n, df in enumerate(res) if n not in removed]
+
+    @_timed('clean')
+    def minimal_cover(self, table: str) -> list:
+        """Couverture minimale des DF d'une table"""
+        # La table doit exister
+        if table not in self.tables:
+            raise UnknownTableError()
+
+        return [tuple(df) for df in self._cached(
+            table, 'cover', lambda: self._cover(self._df_set().rows(table), True))]
+
+    def _replace_dfs(self, old: list, new: list):
+        """Remplace des DF par d'autres en une seule transaction"""
+        if not self.has_df_table:
+            return
+
+        with self._conn:
+            c = self._cursor()
+            c.executemany('DELETE FROM `FuncDep` WHERE `table` = ? AND `lhs` = ? AND `rhs` = ?', old)
+            c.executemany('INSERT OR IGNORE INTO `FuncDep` VALUES (?, ?, ?)', new)
+            self._invalidate_cache({df[0] for df in old + new})
+
+        dfs = self._df_set()
+        for df in old:
+            dfs.remove(df)
+        for df in new:
+            dfs.add(df)
+
+    @_timed('clean')
     def clean_useless_df(self):
-        clean = 0 == len(self.find_useless_df())
+        useless = []
 
-        while not clean:
-            clean = True
-            useless_dfs = self.find_useless_df()
-            if 0 < len(useless_dfs):
-                clean = False
-                df1 = useless_dfs[0]
-                self.del_df(df1[0], df1[1], df1[2])
+        for dfs in self._dfs_by_table().values():
+            cover = set(self._cover(dfs, False))
+            useless += [df for df in dfs if df not in cover]
 
-    def clean_inconsistent_df(self):
-        dfs = self.list_df()
+        self._replace_dfs(useless, [])
 
-        for df in dfs:
-            if df[0] not in self.tables:
-                self.del_df(df[0], df[1], df[2])
+    @_timed('clean')
+    def clean_inconsistent_df(self):
+        dfs = self._df_set()
+        tables = self.tables
+        inconsistent = []
 
-            inconsistent = False
+        for table in dfs.tables():
+            fields = self.get_fields(table) if table in tables and table not in _INTERNAL_TABLES else []
+            missing = [att for att in dfs.attributes(table) if att not in fields]
 
-            for att in df[1].split()+[df[2]]:
-                if att not in self.get_fields(df[0]):
-                    inconsistent = True
+            inconsistent += [df for df in dfs.rows(table) if df[2] in missing]
+            for att in missing:
+                inconsistent += dfs.with_lhs_attribute(table, att)
 
-            if inconsistent:
-                self.del_df(df[0], df[1], df[2])
+        self._replace_dfs(list(dict.fromkeys(inconsistent)), [])
 
+    @_timed('clean')
     def clean(self):
         self.clean_inconsistent_df()
-        self.clean_useless_df()
+
+        old = []
+        new = []
+
+        for dfs in self._dfs_by_table().values():
+            cover = self._cover(dfs, True)
+            cover_set = set(cover)
+            dfs_set = set(dfs)
+
+            old += [df for df in dfs if df not in cover_set]
+            new += [df for df in cover if df not in dfs_set]
+
+        self._replace_dfs(old, new)
 
     def is_key(self, table: str, attributes: str) -> bool:
         all_att = self.get_fields(table)
-        closure = self.df_closure(attributes, self.list_table_df(table))
+        closure = set(self.table_closure(table, attributes))
 
-        return self._is_include(all_att, closure)
+        return closure.issuperset(all_att)
 
-    def super_key(self, table: str) -> list:
-        # La table doit exister
-        if table not in self.tables:
-            raise UnknownTableError()
+    def _key_masks(self, table: str) -> tuple:
+        compiled = self._df_set().compiled(table)
+        fields = self.get_fields(table)
+        compiled.add_attributes(fields)
 
-        att = self.get_fields(table)
-        return [sub for sub in utils.get_all_subset(att) if self.is_key(table, utils.list2str(sub))]
+        return compiled, fields, [compiled.mask(k) for k in self.key(table)]
 
-    def key(self, table: str) -> list:
+    def iter_super_key(self, table: str):
+        """Énumère paresseusement les super clefs d'une table"""
         # La table doit exister
         if table not in self.tables:
             raise UnknownTableError()
 
-        super_key = self.super_key(table)
-        res = []
+        compiled, fields, keys = self._key_masks(table)
+        all_att = compiled.mask(fields)
 
-        for sk in super_key:
-            super_copy = copy.deepcopy(super_key)
-            super_copy.remove(sk)
-            is_key = True
+        for n, key in enumerate(keys):
+            rest = all_att & ~key
+            sub = rest
 
-            for k in super_copy:
-                if self._is_include(k, sk):
-                    is_key = False
+            # Chaque super clef est produite pour la première clef qu'elle contient
+            while True:
+                sk = key | sub
+                if not any(k & sk == k for k in keys[:n]):
+                    yield [f for f in fields if compiled.mask([f]) & sk]
 
-            if is_key:
-                res.append(sk)
+                if sub == 0:
+                    break
+                sub = (sub - 1) & rest
 
-        return res
+    def super_key(self, table: str) -> list:
+        return list(self.iter_super_key(table))
 
-    def is_bcnf_table(self, table: str) -> list:
+    def key(self, table: str) -> list:
+        return self.analyze(table).keys
+
+    def analyze(self, table: str) -> 'TableAnalysis':
+        """Analyse (clefs, formes normales) d'une table, calculée à la demande"""
         # La table doit exister
         if table not in self.tables:
             raise UnknownTableError()
 
-        res = []
-
-        for df in self.list_table_df(table):
-            if not self.is_key(table, df[1]):
-                res.append(df)
+        return TableAnalysis(self, table)
 
-        return res
+    def is_bcnf_table(self, table: str) -> list:
+        return self.analyze(table).bcnf_violations
 
     def is_bcnf(self) -> dict:
         res = {}
 
         for t in self.tables:
-            res[t] = self.is_bcnf_table(t)
+            if t not in _INTERNAL_TABLES:
+                res[t] = self.is_bcnf_table(t)
 
         return res
 
     def is_3nf_table(self, table: str) -> list:
-        # La table doit exister
-        if table not in self.tables:
-            raise UnknownTableError()
-        
-        bcnf = self.is_bcnf_table(table)
-        res = []
-
-        for df in bcnf:
-            ok = False
-            for sk in  self.key(table):
-                if df[2] in sk:
-                    ok = True 
-            
-            if not ok:
-                res.append(df)
-
-        return res
+        return self.analyze(table).nf3_violations
 
     def is_3nf(self) -> dict:
         res = {}
 
         for t in self.tables:
-            res[t] = self.is_3nf_table(t)
+            if t not in _INTERNAL_TABLES:
+                res[t] = self.is_3nf_table(t)
 
         return res
 
@@ -334,88 +1458,685 @@ class DB:
         
         return res
 
-    def get_content(self, att: list, table: str) -> list:
-        para = functools.reduce(lambda a,   b: a+', '+b, att)
-        c = self._conn.cursor()
-        c.execute('SELECT DISTINCT ' + para  + ' FROM ' + table +  ';')
-        return c.fetchall()
-
     def normalize_table(self, table: str):
+        """
+        Décompose une table: chaque nouvelle table est décrite par la
+        description de ses champs, les champs de la table d'origine qu'elle
+        projette et ses DF.
+        """
         new_tables = []
-        dfs = self.list_table_df(table)
-        c = self._conn.cursor()
-        c.execute('PRAGMA table_info(' + table + ')')
+        analysis = self.analyze(table)
+        dfs = list(analysis.dfs)
+        c = self._cursor()
+        c.execute('PRAGMA table_info(' + utils.quote(table) + ')')
 
         fields_description = c.fetchall()
+        all_fields = list(fields_description)
 
-        for df in self.is_3nf_table(table):
+        for df in analysis.nf3_violations:
             field2rm = self.find_fields([df[2]], fields_description)[0]
-            new_fields = self.find_fields(df[1].split()+[df[2]], fields_description)
+            new_fields = self.find_fields(df[1].split()+[df[2]], all_fields)
             fields_description.remove(field2rm)
-   
-            content = self.get_content(df[1].split()+[df[2]], table)
 
             dfs.remove(df)
-            new_tables.append((new_fields, content, [df]))
+            new_tables.append((new_fields, df[1].split()+[df[2]], [df]))
 
-        content = self.get_content([f[1] for f in fields_description], table)
-        new_tables.append((fields_description, content, dfs))
+        new_tables.append((fields_description, [f[1] for f in fields_description], dfs))
 
         return new_tables
 
-    def add_content(self, c, nt, n, table):
-        request = 'INSERT INTO `{}` VALUES ('.format(table+'_'+str(n))
-        insert = ['?' for n in range(len(nt[0]))]
-        request += functools.reduce(lambda a, b: a+', '+b, insert) if len(insert) > 1 else insert[0]
-        request += ');'
+    def add_content(self, c, nt):
+        _add_content(c, nt)
 
-        if len(nt[1]) >= 1:
-            c.executemany(request, nt[1])
+    def _normalize_fingerprint(self) -> str:
+        """Empreinte du schéma et des DF des tables à normaliser"""
+        c = self._cursor()
+        content = []
 
-    def create_new_table(self, c, nt, n, table):
-        request = "CREATE TABLE IF NOT EXISTS `{}`(".format(table+'_'+str(n))
-        fields = []
+        for table in self.tables:
+            if table in _INTERNAL_TABLES:
+                continue
 
-        for field in nt[0]:
-            freq ="`{}` {}".format(field[1], field[2])
-            fields.append(freq)
-        
-        request += functools.reduce(lambda a, b: a+','+b, fields) if len(fields) > 1 else fields[0]
-        request += ');'
+            c.execute('PRAGMA table_info(' + utils.quote(table) + ')')
+            content.append([table, c.fetchall(), sorted(self._df_set().rows(table))])
 
-        c.execute(request)
+        return hashlib.sha1(json.dumps(content).encode()).hexdigest()
 
-    def add_new_df(self, c, nt, n, table):
-        new_df = [(table+'_'+str(n), df[1], df[2]) for df in nt[2]]
-        if len(new_df) > 0:
-            c.executemany('INSERT INTO `FuncDep` VALUES (?, ?, ?);', new_df)
+    def _stat1_distinct(self, table: str, attributes: list) -> int:
+        """Nombre de valeurs distinctes lu dans sqlite_stat1 (ANALYZE), si un index couvre les attributs"""
+        c = self._cursor()
+        c.execute('SELECT name FROM sqlite_master WHERE name = "sqlite_stat1";')
+        if c.fetchone() is None:
+            return None
 
-    def normalize(self):
-        conn = sqlite3.connect('normalize.sqlite')
-        c = conn.cursor()
+        # Sans attribut: nombre de tuples de la table
+        if not attributes:
+            c.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1;', (table,))
+            stat = c.fetchone()
+            return int(stat[0].split()[0]) if stat is not None else None
 
-        utils.execute_sql_file(c, os.path.join('misc', 'init_df_table.sql'))
-        tables = self.tables
+        c.execute('PRAGMA index_list({});'.format(utils.quote(table)))
+
+        for index in c.fetchall():
+            if index[4]:
+                continue
+
+            c.execute('PRAGMA index_info({});'.format(utils.quote(index[1])))
+            columns = [t[2] for t in sorted(c.fetchall())]
+
+            if len(columns) < len(attributes) or set(columns[:len(attributes)]) != set(attributes):
+                continue
+
+            c.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = ? AND idx = ?;', (table, index[1]))
+            stat = c.fetchone()
+
+            if stat is not None:
+                stat = [int(n) for n in stat[0].split()[:len(attributes) + 1]]
+                return math.ceil(stat[0] / stat[-1])
+
+        return None
+
+    def _estimate_projections(self, table: str, projections: list, sample_size: int, rand: random.Random) -> list:
+        """
+        Estime le nombre de tuples distincts et la taille en octets de chaque
+        projection de la table, à partir de sqlite_stat1 si un index couvre la
+        projection, sinon d'un échantillon (estimateur GEE du nombre de valeurs
+        distinctes). La table n'est pas parcourue.
+        """
+        total = self._stat1_distinct(table, []) or self._df_weight((table,))
+        rows = self._sample_rows(table, sample_size, rand)
+        fields = self.get_fields(table)
+        res = []
+
+        for attributes in projections:
+            positions = [fields.index(f) + 1 for f in attributes]
+            counts = collections.Counter(tuple(row[p] for p in positions) for row in rows)
+            width = sum(_value_size(row[p]) for row in rows for p in positions) / len(rows) if rows else 0
+
+            distinct = self._stat1_distinct(table, attributes)
+
+            if distinct is None and (not rows or len(rows) >= total):
+                distinct = len(counts)
+            elif distinct is None:
+                once = sum(1 for n in counts.values() if n == 1)
+                distinct = math.sqrt(total / len(rows)) * once + len(counts) - once
+                distinct = int(min(total, max(len(counts), distinct)))
+
+            res.append((distinct, int(distinct * width)))
+
+        return res
+
+    @_timed('normalize')
+    def plan_normalize(self, sample_size: int = 1000, seed: int = None) -> NormalizePlan:
+        """
+        Calcule la décomposition à partir des DF seules, sans toucher aux
+        données: nouvelles tables, leurs clefs et, si sample_size n'est pas
+        nul, une estimation de leur nombre de tuples et de leur taille.
+        """
+        rand = random.Random(seed)
+        tables = []
+
+        for table in self.tables:
+            if table in _INTERNAL_TABLES:
+                continue
 
-        if 'FuncDep' in tables:
-            tables.remove('FuncDep')
-        
-        for table in tables:
             decom = self.normalize_table(table)
 
-            for n, nt in enumerate(decom):
-                self.create_new_table(c, nt, n, table)
-                self.add_content(c, nt,  n, table)
-                self.add_new_df(c, nt, n, table)
+            if sample_size:
+                estimates = self._estimate_projections(table, [nt[1] for nt in decom], sample_size, rand)
+            else:
+                estimates = [(None, None)] * len(decom)
 
-        conn.commit()
-        conn.close()
+            for n, (nt, (rows, size)) in enumerate(zip(decom, estimates)):
+                attributes = set(nt[1])
+                compiled = CompiledDFs([df for df in nt[2] if attributes.issuperset(df[1].split() + [df[2]])])
+                keys = [[f for f in nt[1] if compiled.mask([f]) & k] for k in compiled.keys(nt[1])]
+
+                tables.append(PlannedTable(nt[0], nt[1], nt[2], table, '{}_{}'.format(table, n), keys, rows, size))
+
+        return NormalizePlan(tables, self._normalize_fingerprint())
+
+    def create_new_table(self, c, nt):
+        _create_new_table(c, nt)
+
+    def add_new_df(self, c, nt):
+        _add_new_df(c, nt)
+
+    @_timed('normalize')
+    def normalize(self, plan: NormalizePlan = None, path: str = 'normalize.sqlite', jobs: int = 1):
+        """
+        Crée une base de données normalisée (normalize.sqlite par défaut) en
+        suivant un plan (calculé s'il n'est pas donné). Elle est attachée à
+        la connexion et remplie par des INSERT ... SELECT: les données ne
+        transitent pas par Python. Avec jobs > 1, les tables sont décomposées
+        par des processus séparés dans des bases intermédiaires, fusionnées
+        ensuite dans la base de sortie.
+        """
+        if plan is None:
+            plan = self.plan_normalize(sample_size=0)
+        elif plan.fingerprint != self._normalize_fingerprint():
+            raise PlanOutdatedError()
+
+        path = os.path.abspath(path)
+        _create_output(path)
+
+        self._conn.commit()
+        c = self._cursor()
+
+        with _attached(c, path, 'normalized'):
+            try:
+                if jobs > 1 and len({nt.source for nt in plan.tables}) > 1:
+                    self._normalize_parallel(c, plan, path, jobs)
+                else:
+                    c.execute('BEGIN;')
+
+                    for nt in plan.tables:
+                        self.create_new_table(c, nt)
+                        self.add_content(c, nt)
+                        self.add_new_df(c, nt)
+
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+    def _normalize_parallel(self, c: sqlite3.Cursor, plan: NormalizePlan, path: str, jobs: int):
+        groups = {}
+        for nt in plan.tables:
+            groups.setdefault(nt.source, []).append(nt)
+
+        heavy_first = sorted(groups, key=lambda table: -self._df_weight((table,)))
+        uri = pathlib.Path(self._path).as_uri() + '?mode=ro'
+
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(path)) as directory:
+            tasks = [(uri, os.path.join(directory, '{}.sqlite'.format(n)), groups[table])
+                     for n, table in enumerate(heavy_first)]
+
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+                staged = list(executor.map(_normalize_worker, tasks))
+
+            # Fusion dans l'ordre du plan: une base intermédiaire à la fois (ATTACH est limité)
+            order = {table: n for n, table in enumerate(groups)}
+
+            for (_, _, tables), staging in sorted(zip(tasks, staged), key=lambda t: order[t[0][2][0].source]):
+                with _attached(c, staging, 'staging'):
+                    c.execute('BEGIN;')
+
+                    for nt in tables:
+                        self.create_new_table(c, nt)
+                        c.execute('INSERT INTO `normalized`.{0} SELECT * FROM `staging`.{0};'.format(
+                            utils.quote(nt.name)))
+
+                    c.execute('INSERT INTO `normalized`.`FuncDep` SELECT * FROM `staging`.`FuncDep`;')
+                    self._conn.commit()
                 
+    def rollback(self):
+        """Annule la transaction en cours et oublie les DF et fermetures lues pendant celle-ci"""
+        self._conn.rollback()
+        self._dfs = None
+        self._closures.clear()
+
     def close(self):
+        self.set_instrumentation(False)
         self._conn.commit()
         self._conn.close()
 
 
+class Stats:
+    """Mesures collectées par un DB instrumenté"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.statements = {}
+        self.operations = {}
+        self._running = set()
+
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+    def add_query(self, sql: str, seconds: float, executed: bool = True):
+        """Ajoute la durée d'une exécution ou d'une lecture de résultats"""
+        count, total = self.statements.get(sql, (0, 0.0))
+        self.statements[sql] = (count + executed, total + seconds)
+        self.queries += executed
+        self.query_seconds += seconds
+
+    @contextlib.contextmanager
+    def timer(self, operation: str):
+        # Seul l'appel le plus externe d'une opération est compté
+        if operation in self._running:
+            yield
+            return
+
+        self._running.add(operation)
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self._running.discard(operation)
+            count, total = self.operations.get(operation, (0, 0.0))
+            self.operations[operation] = (count + 1, total + time.perf_counter() - start)
+
+    def as_dict(self) -> dict:
+        return {
+            'queries': self.queries,
+            'query_seconds': self.query_seconds,
+            'statements': dict(self.statements),
+            'operations': dict(self.operations),
+            'peak_memory': tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None,
+        }
+
+
+class InstrumentedCursor:
+    """Curseur qui compte et chronomètre les requêtes exécutées"""
+
+    def __init__(self, cursor: sqlite3.Cursor, stats: Stats):
+        self._cursor = cursor
+        self._stats = stats
+        self._sql = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        return self._cursor.connection
+
+    def _measure(self, executed: bool, function, *args):
+        start = time.perf_counter()
+
+        try:
+            return function(*args)
+        finally:
+            self._stats.add_query(self._sql, time.perf_counter() - start, executed)
+
+    def execute(self, sql: str, parameters=()):
+        self._sql = sql
+        self._measure(True, self._cursor.execute, sql, parameters)
+        return self
+
+    def executemany(self, sql: str, parameters):
+        self._sql = sql
+        self._measure(True, self._cursor.executemany, sql, parameters)
+        return self
+
+    def fetchone(self):
+        return self._measure(False, self._cursor.fetchone)
+
+    def fetchmany(self, size: int = None):
+        return self._measure(False, self._cursor.fetchmany, size or self._cursor.arraysize)
+
+    def fetchall(self):
+        return self._measure(False, self._cursor.fetchall)
+
+    def __iter__(self):
+        rows = self.fetchmany(256)
+
+        while rows:
+            yield from rows
+            rows = self.fetchmany(256)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TableAnalysis:
+    """
+    Analyse d'une table faite une seule fois: les clefs candidates, les
+    attributs premiers, les fermetures et les DF qui violent la BCNF ou
+    la 3NF sont calculés à la première demande puis réutilisés.
+    """
+
+    def __init__(self, db: DB, table: str):
+        self.table = table
+        self.dfs = db.list_table_df(table)
+        self._db = db
+        self._compiled = db._df_set().compiled(table)
+        self._version = db._df_set().version(table)
+
+    @functools.cached_property
+    def fields(self) -> list:
+        return self._db.get_fields(self.table)
+
+    def closure(self, attributes: str) -> list:
+        return self._db._closure(self.table, self._version, self._compiled, attributes.split())
+
+    def is_key(self, attributes: str) -> bool:
+        return set(self.closure(attributes)).issuperset(self.fields)
+
+    def _keys(self) -> list:
+        with self._db._timer('key'):
+            masks = self._compiled.keys(self.fields)
+
+        return [[f for f in self.fields if self._compiled.mask([f]) & k] for k in masks]
+
+    @functools.cached_property
+    def keys(self) -> list:
+        return self._db._cached(self.table, 'keys', self._keys)
+
+    @functools.cached_property
+    def prime(self) -> set:
+        """Attributs qui appartiennent à au moins une clef candidate"""
+        return {att for k in self.keys for att in k}
+
+    @functools.cached_property
+    def bcnf_violations(self) -> list:
+        violations = self._db._cached(self.table, 'bcnf', lambda: [df for df in self.dfs if not self.is_key(df[1])])
+        return [tuple(df) for df in violations]
+
+    @functools.cached_property
+    def nf3_violations(self) -> list:
+        violations = self._db._cached(self.table, '3nf',
+                                      lambda: [df for df in self.bcnf_violations if df[2] not in self.prime])
+        return [tuple(df) for df in violations]
+
+
+class ClosureCache:
+    """
+    Fermetures mémorisées sous la clef (table, version de l'ensemble de DF,
+    masque des attributs), les moins récemment utilisées étant oubliées
+    au-delà de size. Une fermeture absente part de l'union des fermetures
+    déjà connues de ses sous-ensembles immédiats (un attribut de moins):
+    si X ⊆ Y, X+ ⊆ Y+. Chercher tous les sous-ensembles coûterait plus
+    qu'un calcul de fermeture.
+    """
+
+    def __init__(self, size: int = 4096):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.reused = 0
+        self._entries = collections.OrderedDict()
+
+    def closure_mask(self, table: str, version: int, compiled: 'CompiledDFs', mask: int) -> int:
+        key = (table, version, mask)
+
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+        self.misses += 1
+        start = mask
+        rest = mask
+
+        while rest:
+            bit = rest & -rest
+            rest ^= bit
+            start |= self._entries.get((table, version, mask ^ bit), 0)
+
+        if start != mask:
+            self.reused += 1
+
+        res = compiled.closure_mask(start)
+
+        if self.size > 0:
+            self._entries[key] = res
+
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+        return res
+
+    def clear(self):
+        self._entries.clear()
+
+    def info(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'reused': self.reused, 'entries': len(self._entries),
+                'size': self.size}
+
+
+class FD:
+    """DF compacte: la prémisse et le champ déterminé sont des identifiants d'attributs"""
+
+    __slots__ = ('table', 'lhs', 'rhs', 'row')
+
+    def __init__(self, table: str, lhs: frozenset, rhs: int, row: tuple):
+        self.table = table
+        self.lhs = lhs
+        self.rhs = rhs
+        self.row = row
+
+
+class FDSet:
+    """
+    Ensemble des DF gardé en mémoire. Les noms d'attributs sont internés
+    sous forme d'entiers, les prémisses sont des frozenset et les DF sont
+    indexées par table et par attribut de la prémisse. Les DF restent
+    exposées sous la forme des tuples (table, lhs, rhs) de la table FuncDep.
+    """
+
+    def __init__(self, rows: list = ()):
+        self._ids = {}
+        self._names = []
+        self._fds = {}
+        self._by_table = {}
+        self._by_lhs = {}
+        self._compiled = {}
+        self._base = next(_VERSIONS)
+        self._versions = {}
+
+        for row in rows:
+            self.add(row)
+
+    def _id(self, name: str) -> int:
+        if name not in self._ids:
+            self._ids[name] = len(self._names)
+            self._names.append(sys.intern(name))
+
+        return self._ids[name]
+
+    def _changed(self, table: str):
+        self._versions[table] = next(_VERSIONS)
+        self._compiled.pop(table, None)
+
+    def add(self, row: tuple):
+        row = tuple(row)
+        if row in self._fds:
+            return
+
+        table = sys.intern(row[0])
+        fd = FD(table, frozenset(self._id(att) for att in row[1].split()), self._id(row[2]), row)
+
+        self._fds[row] = fd
+        self._by_table.setdefault(table, {})[row] = fd
+        for att in fd.lhs:
+            self._by_lhs.setdefault((table, att), {})[row] = fd
+
+        self._changed(table)
+
+    def remove(self, row: tuple):
+        fd = self._fds.pop(tuple(row), None)
+        if fd is None:
+            return
+
+        del self._by_table[fd.table][fd.row]
+        if not self._by_table[fd.table]:
+            del self._by_table[fd.table]
+
+        for att in fd.lhs:
+            del self._by_lhs[(fd.table, att)][fd.row]
+
+        self._changed(fd.table)
+
+    def clear(self):
+        self._fds.clear()
+        self._by_table.clear()
+        self._by_lhs.clear()
+        self._compiled.clear()
+        self._base = next(_VERSIONS)
+        self._versions.clear()
+
+    def __contains__(self, row: tuple) -> bool:
+        return tuple(row) in self._fds
+
+    def version(self, table: str) -> int:
+        """Numéro qui change à chaque modification des DF de la table"""
+        return self._versions.get(table, self._base)
+
+    def __len__(self) -> int:
+        return len(self._fds)
+
+    def tables(self) -> list:
+        """Tables qui ont des DF"""
+        return list(self._by_table)
+
+    def rows(self, table: str = None) -> list:
+        if table is None:
+            return list(self._fds)
+
+        return list(self._by_table.get(table, {}))
+
+    def attributes(self, table: str) -> list:
+        """Attributs utilisés par les DF d'une table"""
+        ids = set()
+
+        for fd in self._by_table.get(table, {}).values():
+            ids |= fd.lhs
+            ids.add(fd.rhs)
+
+        return [self._names[n] for n in sorted(ids)]
+
+    def with_lhs_attribute(self, table: str, attribute: str) -> list:
+        """DF d'une table dont la prémisse contient l'attribut"""
+        if attribute not in self._ids:
+            return []
+
+        return list(self._by_lhs.get((table, self._ids[attribute]), {}))
+
+    def compiled(self, table: str) -> 'CompiledDFs':
+        """Représentation compilée des DF d'une table, gardée jusqu'à leur prochaine modification"""
+        if table not in self._compiled:
+            self._compiled[table] = CompiledDFs(self.rows(table))
+
+        return self._compiled[table]
+
+
+class CompiledDFs:
+    """
+    Représentation compilée d'un ensemble de DF: chaque attribut reçoit
+    une position de bit et la fermeture est calculée en temps linéaire
+    avec un compteur par DF (algorithme LINCLOSURE).
+    """
+
+    def __init__(self, dfs: list):
+        self._bits = {}
+        self._names = []
+        self._lhs_size = []
+        self._rhs = []
+        self._uses = []
+        self._no_lhs = []
+
+        for n, df in enumerate(dfs):
+            lhs = {self._bit(att) for att in df[1].split()}
+
+            self._lhs_size.append(len(lhs))
+            self._rhs.append(self._bit(df[2]))
+
+            if len(lhs) == 0:
+                self._no_lhs.append(n)
+
+            for att in lhs:
+                self._uses[att].append(n)
+
+    def _bit(self, att: str) -> int:
+        if att not in self._bits:
+            self._bits[att] = len(self._names)
+            self._names.append(att)
+            self._uses.append([])
+
+        return self._bits[att]
+
+    def mask(self, attributes: list) -> int:
+        """Masque des attributs connus (les autres sont ignorés)"""
+        res = 0
+
+        for att in attributes:
+            if att in self._bits:
+                res |= 1 << self._bits[att]
+
+        return res
+
+    def names(self, mask: int) -> list:
+        """Attributs correspondant à un masque, dans l'ordre des bits"""
+        return [name for n, name in enumerate(self._names) if mask >> n & 1]
+
+    def closure_mask(self, mask: int, skip: set = frozenset()) -> int:
+        """Fermeture d'un masque, sans utiliser les DF dont l'indice est dans skip"""
+        counters = list(self._lhs_size)
+        todo = [n for n in range(len(self._names)) if mask >> n & 1]
+        res = mask
+
+        for n in self._no_lhs:
+            if n not in skip and not res >> self._rhs[n] & 1:
+                res |= 1 << self._rhs[n]
+                todo.append(self._rhs[n])
+
+        while todo:
+            for n in self._uses[todo.pop()]:
+                counters[n] -= 1
+
+                if counters[n] == 0 and n not in skip and not res >> self._rhs[n] & 1:
+                    res |= 1 << self._rhs[n]
+                    todo.append(self._rhs[n])
+
+        return res
+
+    def add_attributes(self, attributes: list):
+        """Donne une position de bit aux attributs qui n'apparaissent dans aucune DF"""
+        for att in attributes:
+            self._bit(att)
+
+    def keys(self, attributes: list) -> list:
+        """
+        Masques des clefs candidates d'une relation. Les attributs jamais
+        déterminés sont dans toutes les clefs, ceux qui ne sont que déterminés
+        dans aucune; le reste du treillis est parcouru niveau par niveau en
+        ignorant les sur-ensembles de clefs déjà trouvées.
+        """
+        self.add_attributes(attributes)
+
+        all_att = self.mask(attributes)
+        lhs_att = 0
+        rhs_att = 0
+
+        for rhs in self._rhs:
+            if all_att >> rhs & 1:
+                rhs_att |= 1 << rhs
+        for att in self._names:
+            if self._uses[self._bits[att]]:
+                lhs_att |= 1 << self._bits[att]
+
+        core = all_att & ~rhs_att
+        middle = [1 << self._bits[att] for att in attributes if (rhs_att & lhs_att) >> self._bits[att] & 1]
+
+        if self.closure_mask(core) & all_att == all_att:
+            return [core]
+
+        res = []
+
+        for size in range(1, len(middle) + 1):
+            for sub in itertools.combinations(middle, size):
+                candidate = core | functools.reduce(operator.or_, sub)
+
+                if any(k & candidate == k for k in res):
+                    continue
+
+                if self.closure_mask(candidate) & all_att == all_att:
+                    res.append(candidate)
+
+        return res
+
+    def closure(self, attributes: list) -> list:
+        """Fermeture d'une liste d'attributs, les attributs donnés en premier"""
+        res = list(dict.fromkeys(attributes))
+        mask = self.mask(res)
+
+        return res + self.names(self.closure_mask(mask) & ~mask)
+
+
 class UnknownTableError(Exception):
     pass
 
@@ -442,3 +2163,21 @@ class DFTableError(Exception):
 
 class RHSIncludeToLHSError(Exception):
     pass
+
+
+class DFBatchError(Exception):
+    """Lot de DF invalide: errors contient les (position, DF, erreur)"""
+
+    def __init__(self, errors: list):
+        super().__init__('{} invalid DF'.format(len(errors)))
+        self.errors = errors
+
+
+class PlanOutdatedError(Exception):
+    """Le schéma ou les DF ont changé depuis le calcul du plan de normalisation"""
+    pass
+
+
+class EngineUnavailableError(Exception):
+    """Le moteur de vérification demandé dépend d'un module qui n'est pas installé"""
+    pass
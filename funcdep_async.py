@@ -0,0 +1,243 @@
+"""
+Façade asyncio de funcdep.DB pour les services asynchrones.
+
+Les appels sont exécutés par des threads dédiés qui ont chacun leur
+propre connexion (une connexion sqlite3 ne peut pas changer de thread):
+plusieurs analyses en lecture tournent en même temps, les écritures
+sont faites une par une et validées tout de suite pour que les autres
+connexions les voient. Une annulation ou un délai dépassé interrompt la
+requête SQL en cours (Connection.interrupt); un calcul en Python pur se
+termine en arrière-plan et son résultat est ignoré.
+
+    db = AsyncDB('base.sqlite', workers=4)
+    keys = await db.key('TRIPS', timeout=10)
+    async for v in db.iter_violations('TRIPS'):
+        ...
+    await db.close()
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import inspect
+import threading
+
+import funcdep
+
+# Méthodes qui modifient la base: elles sont sérialisées puis validées
+_WRITES = {'add_df', 'add_dfs', 'del_df', 'purge_df', 'import_dfs', 'discover_df', 'clean', 'clean_useless_df',
+           'clean_inconsistent_df', 'normalize', 'enable_incremental', 'disable_incremental', 'check_changes',
+           'load_sql_file'}
+
+# Les mesures sont propres à chaque connexion: elles n'ont pas de sens à travers la façade
+_NOT_SHARED = {'close', 'set_instrumentation', 'stats', 'reset_stats', 'closure_cache_info'}
+
+# Les index temporaires sont des écritures: ils bloqueraient les vérifications concurrentes
+_NO_AUTO_INDEX = {'check_df', 'check_table_df', 'iter_violations'}
+
+# Taille de la file entre le thread qui produit un flux et la boucle d'événements
+_STREAM_BUFFER = 64
+
+
+def _load_analysis(analysis: funcdep.TableAnalysis) -> funcdep.TableAnalysis:
+    """Calcule toute l'analyse dans le thread de sa connexion"""
+    for name in ('fields', 'keys', 'prime', 'bcnf_violations', 'nf3_violations'):
+        getattr(analysis, name)
+
+    return analysis
+
+
+class _Worker:
+    """Thread avec sa propre connexion, créée dans le thread"""
+
+    def __init__(self, db_name: str):
+        self._db_name = db_name
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='funcdep')
+        self.db = None
+        self.pending = 0
+
+    def run(self, function):
+        if self.db is None:
+            self.db = funcdep.DB(self._db_name)
+
+        return function(self.db)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+class AsyncDB:
+    """
+    Mêmes méthodes que funcdep.DB, en coroutines qui acceptent en plus un
+    argument timeout (en secondes). Les générateurs (iter_violations,
+    iter_super_key) deviennent des générateurs asynchrones.
+    """
+
+    def __init__(self, db_name: str, workers: int = 4, timeout: float = None):
+        self._name = db_name
+        self._timeout = timeout
+        self._workers = [_Worker(db_name) for _ in range(max(1, workers))]
+        self._write_lock = None
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    def _worker(self) -> _Worker:
+        return min(self._workers, key=lambda w: w.pending)
+
+    def _lock(self) -> asyncio.Lock:
+        # Créé à la première utilisation, dans la boucle qui l'utilise
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+
+        return self._write_lock
+
+    async def _call(self, function, write: bool = False, timeout: float = None):
+        """Exécute function(db) sur un thread et interrompt sa requête si l'appel est annulé"""
+        timeout = self._timeout if timeout is None else timeout
+        worker = self._worker()
+        state = {'cancelled': False, 'running': False}
+        lock = threading.Lock()
+
+        def work(db):
+            with lock:
+                if state['cancelled']:
+                    raise asyncio.CancelledError()
+                state['running'] = True
+
+            try:
+                res = function(db)
+                if write:
+                    db._conn.commit()
+                return res
+            except BaseException:
+                if write:
+                    db.rollback()
+                raise
+            finally:
+                with lock:
+                    state['running'] = False
+
+        worker.pending += 1
+        future = asyncio.get_running_loop().run_in_executor(worker.executor, worker.run, work)
+
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            # Le thread est peut-être déjà passé à un autre appel: on n'interrompt que celui-ci
+            with lock:
+                state['cancelled'] = True
+                if state['running']:
+                    worker.db._conn.interrupt()
+            raise
+        finally:
+            worker.pending -= 1
+
+    async def _method(self, name: str, args: tuple, kwargs: dict, timeout: float):
+        def function(db):
+            res = getattr(db, name)(*args, **kwargs)
+            return _load_analysis(res) if name == 'analyze' else res
+
+        if name not in _WRITES:
+            return await self._call(function, timeout=timeout)
+
+        async with self._lock():
+            return await self._call(function, True, timeout)
+
+    async def _stream(self, name: str, args: tuple, kwargs: dict):
+        """
+        Consomme un générateur de DB dans un thread et en transmet les
+        éléments par une file bornée: le thread attend si le consommateur
+        est en retard et s'arrête si le consommateur abandonne.
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(_STREAM_BUFFER)
+        stop = threading.Event()
+
+        def put(item) -> bool:
+            future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+
+            while True:
+                try:
+                    future.result(0.1)
+                    return True
+                except concurrent.futures.TimeoutError:
+                    if stop.is_set():
+                        future.cancel()
+                        return False
+
+        def produce(db):
+            try:
+                for item in getattr(db, name)(*args, **kwargs):
+                    if not put(('item', item)):
+                        return
+                put(('end', None))
+            except Exception as e:
+                put(('error', e))
+
+        task = asyncio.ensure_future(self._call(produce))
+
+        try:
+            while True:
+                kind, value = await queue.get()
+
+                if kind == 'end':
+                    break
+                if kind == 'error':
+                    raise value
+
+                yield value
+        finally:
+            stop.set()
+            if not task.done():
+                task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def __getattr__(self, name: str):
+        method = getattr(funcdep.DB, name, None)
+
+        if name.startswith('_') or name in _NOT_SHARED or not callable(method):
+            raise AttributeError(name)
+
+        if inspect.isgeneratorfunction(method):
+            @functools.wraps(method)
+            def stream(*args, **kwargs):
+                if name in _NO_AUTO_INDEX:
+                    kwargs.setdefault('auto_index', False)
+                return self._stream(name, args, kwargs)
+
+            return stream
+
+        @functools.wraps(method)
+        async def call(*args, timeout: float = None, **kwargs):
+            if name in _NO_AUTO_INDEX:
+                kwargs.setdefault('auto_index', False)
+            return await self._method(name, args, kwargs, timeout)
+
+        return call
+
+    async def tables(self, timeout: float = None) -> list:
+        return await self._call(lambda db: db.tables, timeout=timeout)
+
+    async def has_df_table(self, timeout: float = None) -> bool:
+        return await self._call(lambda db: db.has_df_table, timeout=timeout)
+
+    async def close(self):
+        """Ferme les connexions, chacune dans son thread, puis arrête les threads"""
+        loop = asyncio.get_running_loop()
+
+        for worker in self._workers:
+            await loop.run_in_executor(worker.executor, worker.close)
+            worker.executor.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
@@ -0,0 +1,259 @@
+"""
+Mesure des performances de funcdep.DB sur des bases générées.
+
+Les bases contiennent une table BENCH(c0, ..., cn) dont les données
+respectent un ensemble de DF en forme de chaîne (c0 -> c1 -> c2 ...),
+d'étoile (c0 -> ci) ou aléatoire, avec une proportion de tuples qui les
+violent. Chaque opération est chronométrée pour des tailles croissantes
+et les résultats sont écrits en JSON, une mesure par ligne, pour pouvoir
+comparer deux révisions.
+
+lancer les mesures:
+    $ python3 funcdep_bench.py --output bench_output.txt
+    $ python3 funcdep_bench.py --compare bench_output.txt
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import zlib
+
+import funcdep
+import utils
+
+SHAPES = ('chain', 'star', 'random')
+
+# En dessous de cette durée les mesures sont trop bruitées pour estimer une pente
+MIN_SECONDS = 0.005
+
+# Pente maximale attendue (log du temps / log de la taille) par opération et forme
+MAX_SLOPES = {
+    'closure': {'chain': 2.0, 'star': 2.0, 'random': 2.0},
+    'key': {'chain': 3.0, 'star': 3.0},
+    'clean': {'chain': 3.0, 'star': 3.0, 'random': 3.0},
+    'check': {'chain': 1.5, 'star': 1.5, 'random': 1.5},
+    'normalize': {'chain': 1.5, 'star': 1.5, 'random': 1.5},
+}
+
+
+def generate_dfs(columns: int, shape: str, seed: int = 0) -> list:
+    """
+    Génère des DF (liste de prémisses, champ déterminé) sur les champs
+    c0 ... c{columns-1}. Les prémisses ne contiennent que des champs
+    d'indice plus petit que le champ déterminé: l'ensemble est acyclique
+    et chaque champ est déterminé par au plus une DF.
+    """
+    rand = random.Random(seed)
+    fields = ['c{}'.format(n) for n in range(columns)]
+
+    if shape == 'chain':
+        return [([fields[n - 1]], fields[n]) for n in range(1, columns)]
+
+    if shape == 'star':
+        return [([fields[0]], fields[n]) for n in range(1, columns)]
+
+    if shape == 'random':
+        return [(rand.sample(fields[:n], rand.randint(1, min(n, 3))), fields[n])
+                for n in range(1, columns) if rand.random() < 0.7]
+
+    raise ValueError('unknown shape: ' + shape)
+
+
+def generate_db(path: str, rows: int, columns: int, dfs: list, violation_rate: float = 0.0, seed: int = 0):
+    """
+    Crée la table BENCH et y insère des données qui respectent les DF,
+    sauf pour une proportion violation_rate des tuples.
+    """
+    rand = random.Random(seed)
+    fields = ['c{}'.format(n) for n in range(columns)]
+    determined = {rhs: lhs for lhs, rhs in dfs}
+    domain = max(2, int(math.sqrt(rows)))
+
+    def generate_row():
+        row = {}
+        for f in fields:
+            if f in determined:
+                # crc32 plutôt que hash(): les données ne dépendent pas de PYTHONHASHSEED
+                row[f] = zlib.crc32(repr(tuple(row[a] for a in determined[f]) + (f,)).encode()) % domain
+            else:
+                row[f] = rand.randrange(domain)
+
+            if f in determined and rand.random() < violation_rate:
+                row[f] = rand.randrange(domain)
+        return tuple(row[f] for f in fields)
+
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute('CREATE TABLE `BENCH`({});'.format(', '.join(utils.quote(f) + ' INTEGER' for f in fields)))
+    c.executemany('INSERT INTO `BENCH` VALUES ({});'.format(', '.join('?' for _ in fields)),
+                  (generate_row() for _ in range(rows)))
+    conn.commit()
+    conn.close()
+
+
+def _timed(function, repeat: int, reset=None) -> float:
+    """Meilleure durée de function sur repeat essais, reset étant appelé (hors mesure) avant chacun"""
+    best = None
+
+    for _ in range(repeat):
+        if reset is not None:
+            reset()
+
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def _open(directory: str, rows: int, columns: int, shape: str, violation_rate: float) -> funcdep.DB:
+    path = os.path.join(directory, 'bench_{}_{}_{}.sqlite'.format(shape, rows, columns))
+    dfs = generate_dfs(columns, shape)
+
+    if os.path.exists(path):
+        os.remove(path)
+
+    generate_db(path, rows, columns, dfs, violation_rate)
+
+    # Sans cache des fermetures: chaque essai doit calculer
+    db = funcdep.DB(path, closure_cache_size=0)
+    for lhs, rhs in dfs:
+        db.add_df('BENCH', utils.list2str(lhs), rhs)
+
+    return db
+
+
+def _forget_analyses(db: funcdep.DB):
+    """Oublie les clefs et couvertures gardées dans FuncDepCache pour que l'essai suivant les recalcule"""
+    db._invalidate_cache()
+    db._conn.commit()
+
+
+def _normalize(db: funcdep.DB, directory: str, jobs: int = 1):
+    path = os.path.join(directory, 'normalize.sqlite')
+    db.normalize(path=path, jobs=jobs)
+    os.remove(path)
+
+
+def run(row_sizes: list, column_sizes: list, shapes: list, violation_rate: float = 0.01, repeat: int = 3) -> list:
+    """
+    Chronomètre chaque opération. Les opérations sur les DF (fermeture,
+    clefs, nettoyage) varient le nombre de champs, celles sur les données
+    (vérification, normalisation) le nombre de tuples.
+    """
+    res = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        for shape in shapes:
+            for columns in column_sizes:
+                db = _open(directory, 100, columns, shape, violation_rate)
+                operations = {
+                    'closure': lambda: db.df_closure('c0', db.list_df()),
+                    'key': lambda: db.key('BENCH'),
+                    'clean': lambda: db.minimal_cover('BENCH'),
+                }
+
+                for op, function in operations.items():
+                    res.append({'op': op, 'shape': shape, 'size': columns,
+                                'seconds': _timed(function, repeat, lambda: _forget_analyses(db))})
+
+                db.close()
+
+            for rows in row_sizes:
+                db = _open(directory, rows, 8, shape, violation_rate)
+                operations = {
+                    'check': lambda: db.check_df(),
+                    'normalize': lambda: _normalize(db, directory),
+                }
+
+                for op, function in operations.items():
+                    res.append({'op': op, 'shape': shape, 'size': rows, 'seconds': _timed(function, repeat)})
+
+                db.close()
+
+    return res
+
+
+def write_results(results: list, output: str):
+    with open(output, 'w') as file:
+        for r in sorted(results, key=lambda r: (r['op'], r['shape'], r['size'])):
+            file.write(json.dumps(r, sort_keys=True) + '\n')
+
+
+def read_results(path: str) -> list:
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def slope(points: list) -> float:
+    """Pente entre les deux plus grandes tailles, en échelle log-log"""
+    points = sorted(points)
+    (s1, t1), (s2, t2) = points[-2], points[-1]
+
+    if t1 <= 0 or t2 <= 0 or s1 == s2:
+        return 0.0
+
+    return math.log(t2 / t1) / math.log(s2 / s1)
+
+
+def find_regressions(results: list, baseline: list = None, tolerance: float = 1.5) -> list:
+    """
+    Signale les opérations dont la croissance dépasse la pente attendue et,
+    si des résultats de référence sont donnés, celles qui sont plus lentes
+    d'un facteur tolerance.
+    """
+    res = []
+    series = {}
+
+    for r in results:
+        series.setdefault((r['op'], r['shape']), []).append((r['size'], r['seconds']))
+
+    for (op, shape), points in sorted(series.items()):
+        limit = MAX_SLOPES.get(op, {}).get(shape)
+        if limit is None or len(points) < 2 or max(points)[1] < MIN_SECONDS:
+            continue
+
+        if slope(points) > limit:
+            res.append('{} ({}): growth exponent {:.2f} above {:.2f}'.format(op, shape, slope(points), limit))
+
+    if baseline is not None:
+        reference = {(r['op'], r['shape'], r['size']): r['seconds'] for r in baseline}
+
+        for r in results:
+            old = reference.get((r['op'], r['shape'], r['size']))
+            if old and r['seconds'] > old * tolerance:
+                res.append('{} ({}, size {}): {:.4f}s instead of {:.4f}s'.format(
+                    r['op'], r['shape'], r['size'], r['seconds'], old))
+
+    return res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='funcdep_bench')
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 2000, 4000, 8000])
+    parser.add_argument('--columns', type=int, nargs='+', default=[8, 16, 32, 64])
+    parser.add_argument('--shapes', nargs='+', choices=SHAPES, default=list(SHAPES))
+    parser.add_argument('--violations', type=float, default=0.01)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='bench_output.txt')
+    parser.add_argument('--compare', default=None)
+    args = parser.parse_args()
+
+    baseline = read_results(args.compare) if args.compare else None
+    results = run(args.rows, args.columns, args.shapes, args.violations, args.repeat)
+    write_results(results, args.output)
+
+    for r in results:
+        print('{op:10} {shape:7} {size:8} {seconds:.4f}s'.format(**r))
+
+    regressions = find_regressions(results, baseline)
+    for message in regressions:
+        print('REGRESSION: ' + message)
+
+    exit(1 if regressions else 0)
@@ -1,6 +1,8 @@
 import argparse
 import cmd
 import functools
+import os
+import sqlite3
 
 import funcdep
 import utils
@@ -24,6 +26,7 @@ type help or ? to get help
 """
     prompt = '>> '
     db = None
+    plan = None
 
     def do_connect(self, args):
         """Connecte l'application au fichier sqlite demandé"""
@@ -54,7 +57,7 @@ type help or ? to get help
             print('ERROR: No DB connected')
             return
 
-        utils.print_list(self.db.tables)
+        utils.print_list([t for t in self.db.tables if t not in funcdep._INTERNAL_TABLES])
 
     def do_fields(self, args):
         """Liste les champs d'une table de la base de données"""
@@ -133,6 +136,96 @@ type help or ? to get help
         except funcdep.DFAddTwiceError:
             print('ERROR: DF already added')
 
+    def do_discover(self, args):
+        """Cherche les DF vérifiées par les données d'une table"""
+        if not self.db:
+            print('ERROR: No DB connected')
+            return
+
+        try:
+            parser = CmdParser('discover')
+            parser.add_argument('table')
+            parser.add_argument('--max-lhs', type=int, default=None)
+            args = parser.parse_args(args.split())
+        except ArgumentError:
+            return
+
+        try:
+            dfs = self.db.discover_df(args.table, args.max_lhs)
+        except (funcdep.UnknownTableError, funcdep.DFTableError):
+            print('ERROR: Table not exists')
+            return
+
+        utils.print_list(dfs)
+
+    def do_import(self, args):
+        """Ajoute les DF d'un fichier CSV ou JSON"""
+        if not self.db:
+            print('ERROR: No DB connected')
+            return
+
+        try:
+            parser = CmdParser('import')
+            parser.add_argument('file')
+            args = parser.parse_args(args.split())
+        except ArgumentError:
+            return
+
+        try:
+            self.db.import_dfs(args.file)
+        except OSError:
+            print('ERROR: Cannot read file')
+        except (KeyError, ValueError):
+            print('ERROR: Invalid file')
+        except funcdep.DFBatchError as error:
+            for n, df, e in error.errors:
+                print('ERROR: DF {} {}: {}'.format(n + 1, df, type(e).__name__))
+
+    def do_load(self, args):
+        """Exécute un script SQL (un dump par exemple) sur la base, en affichant l'avancement"""
+        if not self.db:
+            print('ERROR: No DB connected')
+            return
+
+        try:
+            parser = CmdParser('load')
+            parser.add_argument('file')
+            parser.add_argument('--batch', type=int, default=1000)
+            args = parser.parse_args(args.split())
+        except ArgumentError:
+            return
+
+        try:
+            size = os.path.getsize(args.file)
+            count = self.db.load_sql_file(args.file, args.batch, lambda n, read: print(
+                '\r{} statements, {:.1%}'.format(n, read / size if size else 1), end='', flush=True))
+            print('\r{} statements loaded'.format(count))
+        except OSError:
+            print('ERROR: Cannot read file')
+        except sqlite3.Error as e:
+            print('\nERROR: {}'.format(e))
+
+    def do_export(self, args):
+        """Écrit les DF de la base ou d'une table dans un fichier CSV ou JSON"""
+        if not self.db:
+            print('ERROR: No DB connected')
+            return
+
+        try:
+            parser = CmdParser('export')
+            parser.add_argument('file')
+            parser.add_argument('table', nargs='?')
+            args = parser.parse_args(args.split())
+        except ArgumentError:
+            return
+
+        try:
+            self.db.export_dfs(args.file, args.table)
+        except funcdep.UnknownTableError:
+            print('ERROR: Table not exists')
+        except OSError:
+            print('ERROR: Cannot write file')
+
     def do_del(self, args):
         """Supprime une DF de la base de données"""
         if not self.db:
@@ -166,17 +259,81 @@ type help or ? to get help
         try:
             parser = CmdParser('ckeck')
             parser.add_argument('table', nargs='?')
+            parser.add_argument('--first', action='store_true')
+            parser.add_argument('--rows', action='store_true')
+
+            # Chaque mode de vérification ignore les options des autres
+            mode = parser.add_mutually_exclusive_group()
+            mode.add_argument('--top', type=int, default=None)
+            mode.add_argument('--jobs', type=int, default=1)
+            mode.add_argument('--changes', action='store_true')
+            mode.add_argument('--fast', action='store_true')
+            mode.add_argument('--sample', type=int, default=None)
+            mode.add_argument('--engine', choices=funcdep.ENGINES, default='sql')
             args = parser.parse_args(args.split())
         except ArgumentError:
             return
 
-        res = None
+        if args.changes:
+            self._print_check(args.table, changes=True)
+            return
+
+        if args.fast:
+            self._print_check(args.table, fast=True)
+            return
+
+        if args.engine != 'sql':
+            self._print_check(args.table, engine=args.engine)
+            return
 
+        if args.sample:
+            self._print_sample(args.table, args.sample)
+            return
+
+        if args.jobs > 1:
+            self._print_check(args.table, args.jobs)
+            return
+
+        try:
+            dfs = self.db.list_table_df(args.table) if args.table else self.db.list_df()
+            violations = self.db.iter_violations(args.table, args.top, not args.rows)
+        except funcdep.UnknownTableError:
+            print('ERROR: Table not exists')
+            return
+
+        bad_dfs = []
+
+        for v in violations:
+            if v.df not in bad_dfs:
+                bad_dfs.append(v.df)
+                print(v.df)
+                print('This DF is not respected')
+
+            print('\t- {}: {} tuples, {} values'.format(v.lhs, v.count, v.rhs_count))
+            for t in v.sample:
+                print('\t\t', t)
+
+            if args.first:
+                return
+
+        for df in dfs:
+            if df not in bad_dfs:
+                print(df, 'ok')
+
+    def _print_check(self, table, jobs=1, changes=False, fast=False, engine='sql'):
         try:
-            res = self.db.check_table_df(args.table) if args.table else self.db.check_df()
+            if changes:
+                res = self.db.check_changes(table)
+            elif table:
+                res = self.db.check_table_df(table, jobs, fast=fast, engine=engine)
+            else:
+                res = self.db.check_df(jobs, fast=fast, engine=engine)
         except funcdep.UnknownTableError:
             print('ERROR: Table not exists')
             return
+        except funcdep.EngineUnavailableError as e:
+            print('ERROR: {} is not installed'.format(e))
+            return
 
         for df in res:
             print(df, end='')
@@ -189,6 +346,86 @@ type help or ? to get help
                 for t in bad_tuples:
                     print('\t- ', t)
 
+    def _print_sample(self, table, size):
+        try:
+            res = self.db.sample_df(size, table)
+        except funcdep.UnknownTableError:
+            print('ERROR: Table not exists')
+            return
+
+        for df, sample in res.items():
+            scope = 'of the table' if sample.probed else 'within samples of this size'
+            print(df, end='')
+
+            if sample.hits == 0:
+                print(' ok on {} sampled tuples (at most {:.2%} {} in violation, 95% confidence)'.format(
+                    sample.size, sample.high, scope))
+            else:
+                print('\nThis DF is not respected: {}/{} sampled tuples ({:.2%} to {:.2%} {}, 95% confidence)'.format(
+                    sample.hits, sample.size, sample.low, sample.high, scope))
+                for t in sample.rows[:5]:
+                    print('\t- ', t)
+
+    def do_error(self, args):
+        """Mesure l'écart des DF aux données (error [table] [--threshold T] [--worst N])"""
+        if not self.db:
+            print('ERROR: No DB connected')
+            return
+
+        try:
+            parser = CmdParser('error')
+            parser.add_argument('table', nargs='?')
+            parser.add_argument('--threshold', type=float, default=0.0)
+            parser.add_argument('--worst', type=int, default=5)
+            args = parser.parse_args(args.split())
+        except ArgumentError:
+            return
+
+        tables = [args.table] if args.table else list(dict.fromkeys(df[0] for df in self.db.list_df()))
+
+        for table in tables:
+            try:
+                res = self.db.df_error(table, args.worst)
+            except funcdep.UnknownTableError:
+                print('ERROR: Table not exists')
+                return
+
+            for df, error in res.items():
+                print(df, 'g3 = {:.2%} ({}/{} tuples to delete, {} groups)'.format(
+                    error.g3, error.removed, error.rows, error.groups), end='')
+
+                if error.removed == 0:
+                    print(' ok')
+                elif error.g3 <= args.threshold:
+                    print(' holds approximately')
+                else:
+                    print('\nThis DF is not respected')
+
+                for g in error.worst:
+                    print('\t- {}: {} tuples, {} values, {} to delete'.format(g.lhs, g.count, g.rhs_count, g.removed))
+
+    def do_incremental(self, args):
+        """Active ou désactive la vérification incrémentale (incremental on|off [table])"""
+        if not self.db:
+            print('ERROR: No DB connected')
+            return
+
+        try:
+            parser = CmdParser('incremental')
+            parser.add_argument('action', choices=['on', 'off'])
+            parser.add_argument('table', nargs='?')
+            args = parser.parse_args(args.split())
+        except ArgumentError:
+            return
+
+        try:
+            if args.action == 'on':
+                self.db.enable_incremental(args.table)
+            else:
+                self.db.disable_incremental(args.table)
+        except (funcdep.UnknownTableError, funcdep.DFTableError):
+            print('ERROR: Table not exists')
+
     def do_clean(self, args):
         """Supprime les DF inutiles"""
         self.db.clean()
@@ -291,12 +528,110 @@ type help or ? to get help
                     print('\t- ', df)
 
     def do_normalize(self, args):
-        """Crée une autre basse de données(normalize.sqlite) normalisée"""
+        """
+        Crée une autre basse de données(normalize.sqlite) normalisée
+        (normalize [--plan] [file] [--output path] [--jobs n]). Avec --plan,
+        affiche la décomposition et les estimations sans toucher aux données
+        et garde le plan (dans file si donné); sinon exécute le plan gardé ou
+        celui du fichier.
+        """
+        if not self.db:
+            print('ERROR: No DB connected')
+            return
+
+        try:
+            parser = CmdParser('normalize')
+            parser.add_argument('file', nargs='?')
+            parser.add_argument('--plan', action='store_true')
+            parser.add_argument('--output', default='normalize.sqlite')
+            parser.add_argument('--jobs', type=int, default=1)
+            args = parser.parse_args(args.split())
+        except ArgumentError:
+            return
+
+        if args.plan:
+            self.plan = self.db.plan_normalize()
+            self._print_plan(self.plan)
+
+            if args.file:
+                try:
+                    funcdep.write_plan(self.plan, args.file)
+                except OSError:
+                    print('ERROR: Cannot write file')
+            return
+
+        plan = self.plan
+
+        if args.file:
+            try:
+                plan = funcdep.read_plan(args.file)
+            except (OSError, ValueError, KeyError, TypeError):
+                print('ERROR: Cannot read plan')
+                return
+
+        try:
+            self.db.normalize(plan, args.output, args.jobs)
+        except funcdep.PlanOutdatedError:
+            print('ERROR: Schema or DF changed since the plan, run normalize --plan again')
+            return
+
+        self.plan = None
+
+    def _print_plan(self, plan):
+        for nt in plan.tables:
+            print('{} (from {}): {}'.format(nt.name, nt.source, ', '.join(nt.attributes)))
+            print('\tkeys: ' + '; '.join(' '.join(k) for k in nt.keys))
+
+            for df in nt.dfs:
+                print('\tdf: {} -> {}'.format(df[1], df[2]))
+
+            if nt.rows is not None:
+                print('\testimated: {} tuples, {} bytes'.format(nt.rows, nt.size))
+
+        sizes = [nt.size for nt in plan.tables if nt.size is not None]
+        if sizes:
+            print('estimated output size: {} bytes'.format(sum(sizes)))
+
+    def do_stats(self, args):
+        """Affiche les mesures de performances (stats [on|off|reset])"""
         if not self.db:
             print('ERROR: No DB connected')
             return
 
-        self.db.normalize()
+        try:
+            parser = CmdParser('stats')
+            parser.add_argument('action', nargs='?', choices=['on', 'off', 'reset'])
+            args = parser.parse_args(args.split())
+        except ArgumentError:
+            return
+
+        if args.action == 'on':
+            self.db.set_instrumentation(True)
+        elif args.action == 'off':
+            self.db.set_instrumentation(False)
+        elif args.action == 'reset':
+            self.db.reset_stats()
+        else:
+            cache = self.db.closure_cache_info()
+            print('closure cache: {hits} hits, {misses} misses ({reused} from subsets), {entries}/{size} entries'
+                  .format(**cache))
+
+            stats = self.db.stats()
+            if not stats:
+                print('Instrumentation is off (stats on)')
+                return
+
+            print('\noperations:')
+            for op, (count, seconds) in sorted(stats['operations'].items()):
+                print('\t- {}: {} calls, {:.4f}s'.format(op, count, seconds))
+
+            print('queries: {}, {:.4f}s'.format(stats['queries'], stats['query_seconds']))
+            slowest = sorted(stats['statements'].items(), key=lambda s: -s[1][1])[:5]
+            for sql, (count, seconds) in slowest:
+                print('\t- {:.4f}s x{}: {}'.format(seconds, count, sql))
+
+            if stats['peak_memory'] is not None:
+                print('peak memory: {} bytes\n'.format(stats['peak_memory']))
 
     def do_exit(self, args):
         """Quite l'application"""
@@ -0,0 +1,169 @@
+"""
+Découverte des DF minimales vérifiées par les données d'une table
+(algorithme TANE): le treillis des attributs est parcouru niveau par
+niveau sur des partitions dépouillées, avec élagage par les ensembles
+candidats C+ et par les clefs.
+
+Les ensembles d'attributs sont des masques de bits sur les indices des
+colonnes et une partition est une liste de classes (listes d'indices de
+lignes) dont on a retiré les classes d'un seul élément. Les partitions
+sont raffinées à partir des colonnes encodées par des entiers, sans
+requête SQL par candidat.
+"""
+
+import sqlite3
+
+import utils
+
+
+def read_columns(c: sqlite3.Cursor, table: str, fields: list, batch: int = 10000) -> list:
+    """
+    Lit la table une seule fois et renvoie chaque colonne encodée par
+    des entiers (une valeur distincte = un entier).
+    """
+    dictionaries = [{} for _ in fields]
+    columns = [[] for _ in fields]
+
+    c.execute('SELECT {} FROM {};'.format(', '.join(utils.quote(f) for f in fields), utils.quote(table)))
+    rows = c.fetchmany(batch)
+
+    while rows:
+        for row in rows:
+            for dictionary, column, value in zip(dictionaries, columns, row):
+                column.append(dictionary.setdefault(value, len(dictionary)))
+        rows = c.fetchmany(batch)
+
+    return columns
+
+
+def partition(column: list) -> list:
+    """Partition dépouillée d'une colonne encodée"""
+    classes = {}
+
+    for t, code in enumerate(column):
+        classes.setdefault(code, []).append(t)
+
+    return [cls for cls in classes.values() if len(cls) > 1]
+
+
+def _bits(mask: int):
+    n = 0
+    while mask:
+        if mask & 1:
+            yield n
+        mask >>= 1
+        n += 1
+
+
+def _error(partition: list) -> int:
+    return sum(len(cls) for cls in partition) - len(partition)
+
+
+def _product(p: list, column: list) -> list:
+    """Raffine une partition par une colonne encodée"""
+    res = []
+
+    for cls in p:
+        if len(cls) == 2:
+            if column[cls[0]] == column[cls[1]]:
+                res.append(cls)
+            continue
+
+        groups = {}
+        for t in cls:
+            groups.setdefault(column[t], []).append(t)
+        res.extend([g for g in groups.values() if len(g) > 1])
+
+    return res
+
+
+def tane(columns: list, max_lhs: int = None) -> list:
+    """
+    Renvoie les DF minimales et non triviales vérifiées par des colonnes
+    encodées sous la forme (masque de la prémisse, indice de l'attribut
+    déterminé).
+    """
+    n_rows = len(columns[0]) if columns else 0
+
+    if n_rows == 0:
+        return []
+
+    partitions = [partition(column) for column in columns]
+    full = (1 << len(columns)) - 1
+    res = []
+    errors = {0: n_rows - 1}
+    cplus = {0: full}
+    level = {1 << a: p for a, p in enumerate(partitions)}
+    previous = {0: [list(range(n_rows))] if n_rows > 1 else []}
+    size = 1
+
+    for x, p in level.items():
+        errors[x] = _error(p)
+
+    while level:
+
+        # Ensembles candidats des membres droits
+        for x in level:
+            cp = full
+            for a in _bits(x):
+                cp &= cplus.get(x & ~(1 << a), 0)
+            cplus[x] = cp
+
+        # DF valides du niveau
+        for x in level:
+            for a in _bits(x & cplus[x]):
+                lhs = x & ~(1 << a)
+                if errors[lhs] == errors[x]:
+                    res.append((lhs, a))
+                    cplus[x] &= x & ~(1 << a)
+
+        # Élagage
+        for x in list(level):
+            if cplus[x] == 0:
+                del level[x]
+
+            elif errors[x] == 0:
+                if max_lhs is not None and size > max_lhs:
+                    del level[x]
+                    continue
+
+                # X est une super clef: X -> A est minimale si aucun X \ {B} ne détermine A
+                for a in _bits(cplus[x] & ~x):
+                    minimal = True
+
+                    for b in _bits(x):
+                        z = x & ~(1 << b)
+                        y = z | (1 << a)
+                        if y not in errors:
+                            errors[y] = _error(_product(previous[z], columns[a]))
+                        if errors[z] == errors[y]:
+                            minimal = False
+                            break
+
+                    if minimal:
+                        res.append((x, a))
+
+                del level[x]
+
+        if max_lhs is not None and size > max_lhs:
+            break
+
+        # Niveau suivant: on combine les ensembles qui ne diffèrent que par leur plus grand attribut
+        blocks = {}
+        for x in sorted(level):
+            blocks.setdefault(x & ~(1 << (x.bit_length() - 1)), []).append(x)
+
+        next_level = {}
+        for block in blocks.values():
+            for i, x1 in enumerate(block):
+                for x2 in block[i + 1:]:
+                    y = x1 | x2
+                    if all(y & ~(1 << a) in level for a in _bits(y)):
+                        next_level[y] = _product(level[x1], columns[x2.bit_length() - 1])
+                        errors[y] = _error(next_level[y])
+
+        previous = level
+        level = next_level
+        size += 1
+
+    return res
@@ -0,0 +1,123 @@
+"""
+Vérification des DF sur des colonnes NumPy (moteur 'numpy' de check_df).
+
+Chaque table est lue une seule fois, par lots, et ses colonnes sont
+encodées par des entiers (une valeur distincte = un entier). Toutes les
+DF de la table sont ensuite vérifiées sur ces colonnes: la prémisse est
+réduite à un code de groupe (partagé par les DF de même prémisse) et les
+couples (groupe, valeur déterminée) distincts sont comptés par un tri.
+Seuls les tuples en violation sont relus dans la base.
+
+Comme pour la requête SQL, NULL est une valeur comme une autre, dans la
+prémisse comme dans le champ déterminé. Les valeurs sont comparées comme
+en Python: une table qui déclare une collation (COLLATE NOCASE...) est
+vérifiée par SQL (voir funcdep._has_collation).
+"""
+
+import itertools
+import sqlite3
+
+import numpy as np
+
+import utils
+
+# Au-delà, le produit des codes de la prémisse pourrait dépasser un entier de 64 bits
+_MAX_CODE = 1 << 62
+
+
+def read_columns(c: sqlite3.Cursor, table: str, fields: list, batch: int = 10000) -> tuple:
+    """
+    Lit la table une seule fois et renvoie les rowid et chaque colonne
+    encodée par des entiers.
+    """
+    dictionaries = [{} for _ in fields]
+    counters = [itertools.count() for _ in fields]
+    chunks = [[] for _ in fields]
+    rowids = []
+
+    c.execute('SELECT rowid, {} FROM {};'.format(', '.join(utils.quote(f) for f in fields), utils.quote(table)))
+    rows = c.fetchmany(batch)
+
+    while rows:
+        columns = list(zip(*rows))
+        rowids.append(np.array(columns[0], dtype=np.int64))
+
+        # Un numéro est tiré pour chaque valeur mais seules les nouvelles le gardent: les codes
+        # ne se suivent pas, mais l'encodage reste dans la boucle C de map
+        for dictionary, counter, chunk, column in zip(dictionaries, counters, chunks, columns[1:]):
+            chunk.append(np.fromiter(map(dictionary.setdefault, column, counter), dtype=np.int64, count=len(column)))
+
+        rows = c.fetchmany(batch)
+
+    def concatenate(parts):
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+    return concatenate(rowids), [concatenate(chunk) for chunk in chunks]
+
+
+def _size(column: np.ndarray) -> int:
+    """Borne des codes d'une colonne encodée"""
+    return int(column.max()) + 1 if len(column) else 0
+
+
+def group_codes(columns: list, sizes: list, n_rows: int) -> tuple:
+    """
+    Code de groupe de chaque tuple pour une prémisse (ses colonnes encodées
+    et les bornes de leurs codes), renuméroté de 0 au nombre de groupes.
+    """
+    codes = np.zeros(n_rows, dtype=np.int64)
+    size = 1
+
+    for column, n in zip(columns, sizes):
+        if size * max(n, 1) >= _MAX_CODE:
+            uniques, codes = np.unique(codes, return_inverse=True)
+            size = len(uniques)
+
+        codes = codes * n + column
+        size *= max(n, 1)
+
+    uniques, codes = np.unique(codes, return_inverse=True)
+
+    return codes.reshape(-1), len(uniques)
+
+
+def violating_rows(groups: np.ndarray, n_groups: int, rhs: np.ndarray, n_values: int) -> np.ndarray:
+    """Indices des tuples dont le groupe a plusieurs valeurs du champ déterminé"""
+    pairs = np.unique(groups * n_values + rhs)
+    distinct = np.bincount(pairs // max(n_values, 1), minlength=n_groups)
+
+    return np.flatnonzero((distinct > 1)[groups])
+
+
+def fetch_rows(c: sqlite3.Cursor, table: str, rowids: list, chunk: int = 500) -> list:
+    """Tuples distincts de rowid donnés (triés), dans l'ordre des rowid comme SELECT DISTINCT"""
+    res = []
+
+    for n in range(0, len(rowids), chunk):
+        part = rowids[n:n + chunk]
+        c.execute('SELECT * FROM {} WHERE rowid IN ({}) ORDER BY rowid;'.format(
+            utils.quote(table), ', '.join('?' for _ in part)), part)
+        res += c.fetchall()
+
+    return list(dict.fromkeys(res))
+
+
+def check_table(c: sqlite3.Cursor, table: str, dfs: list, batch: int = 10000) -> dict:
+    """Vérifie les DF d'une même table et renvoie, pour chacune, les tuples en violation"""
+    fields = list(dict.fromkeys(f for df in dfs for f in df[1].split() + [df[2]]))
+    rowids, columns = read_columns(c, table, fields, batch)
+    sizes = [_size(column) for column in columns]
+    position = {f: n for n, f in enumerate(fields)}
+    groups = {}
+    res = {}
+
+    for df in dfs:
+        if df[1] not in groups:
+            lhs = [position[f] for f in df[1].split()]
+            groups[df[1]] = group_codes([columns[p] for p in lhs], [sizes[p] for p in lhs], len(rowids))
+
+        rhs = position[df[2]]
+        found = violating_rows(*groups[df[1]], columns[rhs], sizes[rhs])
+        res[df] = fetch_rows(c, table, np.sort(rowids[found]).tolist())
+
+    return res
@@ -1,8 +1,11 @@
+import asyncio
 import os
 import sqlite3
 import unittest
 
 import funcdep
+import funcdep_async
+import funcdep_bench
 import utils
 
 TEST_DB = os.path.join(os.getcwd(), 'test.sqlite')
@@ -50,6 +53,52 @@ class FuncDepTest(unittest.TestCase):
         for f in fields:
             self.assertIn(f, self.db.get_fields('BUSES'))
 
+    def test_schema_change_other_connection(self):
+        self.assertNotIn('DRIVERS', self.db.tables)
+
+        conn = sqlite3.connect(TEST_DB)
+        conn.execute('CREATE TABLE `DRIVERS`(`Name` VARCHAR, `Licence` VARCHAR);')
+        conn.commit()
+
+        self.assertIn('DRIVERS', self.db.tables)
+        self.assertEqual(['Name', 'Licence'], self.db.get_fields('DRIVERS'))
+
+        conn.execute('DROP TABLE `DRIVERS`;')
+        conn.commit()
+        conn.close()
+
+        self.assertNotIn('DRIVERS', self.db.tables)
+
+    def test_df_set(self):
+        dfs = funcdep.FDSet([('BUSES', 'Number_Plate', 'Chassis'), ('BUSES', 'Chassis', 'Make'),
+                             ('TRIPS', 'Date Number_Plate', 'Driver')])
+
+        self.assertEqual(['BUSES', 'TRIPS'], dfs.tables())
+        self.assertEqual([('TRIPS', 'Date Number_Plate', 'Driver')], dfs.with_lhs_attribute('TRIPS', 'Number_Plate'))
+        self.assertEqual([], dfs.with_lhs_attribute('BUSES', 'Make'))
+        self.assertEqual(['Number_Plate', 'Chassis', 'Make'], dfs.attributes('BUSES'))
+
+        compiled = dfs.compiled('BUSES')
+        self.assertIs(compiled, dfs.compiled('BUSES'))
+        dfs.remove(('BUSES', 'Chassis', 'Make'))
+        self.assertIsNot(compiled, dfs.compiled('BUSES'))
+        self.assertEqual(['Number_Plate', 'Chassis'], dfs.compiled('BUSES').closure(['Number_Plate']))
+
+        # Les DF ajoutées par une autre connexion sont relues
+        self.db.purge_df()
+        self.db.add_df('BUSES', 'Chassis', 'Make')
+        self.db.close()
+        self.db = funcdep.DB(TEST_DB)
+        self.assertEqual([('BUSES', 'Chassis', 'Make')], self.db.list_df())
+
+        conn = sqlite3.connect(TEST_DB)
+        conn.execute("INSERT INTO `FuncDep` VALUES ('BUSES', 'Number_Plate', 'Chassis');")
+        conn.commit()
+        conn.close()
+
+        self.assertIn(('BUSES', 'Number_Plate', 'Chassis'), self.db.list_df())
+        self.db.purge_df()
+
     def test_table_df(self):
         self.db.add_df('BUSES', 'Chassis', 'Mileage')
         self.assertIn('FuncDep', self.db.tables)
@@ -138,6 +187,327 @@ class FuncDepTest(unittest.TestCase):
         self.assertEqual(res_trips, self.db.check_table_df('TRIPS'))
         self.assertEqual(res_buses, self.db.check_table_df('BUSES'))
 
+    def test_check_df_all_groups(self):
+        self.db.purge_df()
+        self.db.add_df('TRIPS', 'Driver', 'Number_Plate')
+
+        res = self.db.check_table_df('TRIPS')[('TRIPS', 'Driver', 'Number_Plate')]
+
+        # John et Tim ont tous les deux conduit plusieurs bus
+        self.assertEqual(6, len(res))
+        self.assertEqual({'John', 'Tim'}, {t[2] for t in res})
+
+        # Une valeur NULL du champ déterminé est une valeur différente
+        self.db._conn.execute('CREATE TABLE `NULLS`(`a`, `b`);')
+        self.db._conn.execute("INSERT INTO `NULLS` VALUES (1, 'x'), (1, NULL), (2, 'y'), (2, 'y');")
+
+        try:
+            self.db.add_df('NULLS', 'a', 'b')
+            self.assertEqual([(1, 'x'), (1, None)], self.db.check_table_df('NULLS')[('NULLS', 'a', 'b')])
+            self.assertEqual([((1,), 2, 2)], [v[1:4] for v in self.db.iter_violations('NULLS')])
+        finally:
+            self.db.purge_df()
+            self.db._conn.execute('DROP TABLE `NULLS`;')
+            self.db._conn.commit()
+
+    def test_discover_df(self):
+        self.db.purge_df()
+
+        dfs = self.db.discover_df('BUSES', max_lhs=1)
+
+        self.assertIn(('BUSES', 'Number_Plate', 'Make'), dfs)
+        self.assertIn(('BUSES', 'Mileage', 'Chassis'), dfs)
+        self.assertNotIn(('BUSES', 'Chassis', 'Make'), dfs)
+        self.assertEqual(sorted(dfs), sorted(self.db.list_table_df('BUSES')))
+
+        for df in dfs:
+            self.assertEqual([], self.db.check_table_df('BUSES')[df])
+
+        # Une colonne constante n'est pas une DF de prémisse vide
+        self.db._conn.execute('CREATE TABLE `CONSTANT`(`a`, `k`);')
+        self.db._conn.execute("INSERT INTO `CONSTANT` VALUES (1, 'k'), (2, 'k');")
+
+        try:
+            self.assertEqual([], self.db.discover_df('CONSTANT'))
+            self.assertEqual([], self.db.list_table_df('CONSTANT'))
+        finally:
+            self.db._conn.execute('DROP TABLE `CONSTANT`;')
+            self.db._conn.commit()
+
+    def test_check_df_jobs(self):
+        self.db.purge_df()
+        self.db.add_df('TRIPS', 'Driver', 'Number_Plate')
+        self.db.add_df('TRIPS', 'Date Driver Departure_Time', 'Destination')
+        self.db.add_df('BUSES', 'Chassis', 'Make')
+
+        expected = self.db.check_df()
+        res = self.db.check_df(jobs=2)
+
+        self.assertEqual(expected, res)
+        self.assertEqual(list(expected), list(res))
+
+    def test_check_df_fast(self):
+        self.db.purge_df()
+        self.db.add_df('TRIPS', 'Driver', 'Number_Plate')
+        self.db.add_df('BUSES', 'Number_Plate', 'Chassis')
+
+        expected = self.db.check_df()
+        res = self.db.check_df(fast=True)
+
+        df = ('TRIPS', 'Driver', 'Number_Plate')
+
+        self.assertEqual(list(expected), list(res))
+        self.assertEqual([], res[('BUSES', 'Number_Plate', 'Chassis')])
+        self.assertEqual(2, len(res[df]))
+        self.assertTrue(set(res[df]) <= set(expected[df]))
+
+        # Trop de valeurs de la prémisse à garder en mémoire: SQLite cherche le groupe en violation
+        self.db._FAST_MAX_GROUPS = 0
+        res = self.db.check_df(fast=True)
+
+        self.assertEqual([], res[('BUSES', 'Number_Plate', 'Chassis')])
+        self.assertEqual(2, len(res[df]))
+        self.assertTrue(set(res[df]) <= set(expected[df]))
+        self.assertNotEqual(res[df][0][1], res[df][1][1])
+
+    def test_check_df_collation(self):
+        self.db.purge_df()
+
+        # 'x' et 'X' sont une même valeur pour la collation NOCASE
+        self.db._conn.execute('CREATE TABLE `CASES`(`a`, `b` COLLATE NOCASE);')
+        self.db._conn.execute("INSERT INTO `CASES` VALUES (1, 'x'), (1, 'X'), (2, 'y'), (2, 'z'), (2, 'Y');")
+
+        try:
+            self.db.add_df('CASES', 'a', 'b')
+            df = ('CASES', 'a', 'b')
+
+            self.assertEqual([(2, 'y'), (2, 'z')], self.db.check_table_df('CASES')[df])
+            self.assertEqual([(2, 'y'), (2, 'z')], self.db.check_table_df('CASES', fast=True)[df])
+
+            res = self.db.sample_df(10, 'CASES', seed=1)[df]
+            self.assertEqual((5, 3, False), (res.size, res.hits, res.probed))
+            self.assertEqual({(2, 'y'), (2, 'z'), (2, 'Y')}, set(res.rows))
+        finally:
+            self.db.purge_df()
+            self.db._conn.execute('DROP TABLE `CASES`;')
+            self.db._conn.commit()
+
+    @unittest.skipIf(funcdep.funcdep_numpy is None, 'numpy is not installed')
+    def test_check_df_numpy(self):
+        self.db.purge_df()
+        self.db.add_df('TRIPS', 'Driver', 'Number_Plate')
+        self.db.add_df('TRIPS', 'Date Driver', 'Number_Plate')
+        self.db.add_df('TRIPS', 'Date Driver Departure_Time', 'Destination')
+        self.db.add_df('BUSES', 'Chassis', 'Make')
+        self.db.add_df('BUSES', 'Number_Plate', 'Chassis')
+
+        self.assertEqual(self.db.check_df(), self.db.check_df(engine='numpy'))
+        self.assertEqual(self.db.check_table_df('TRIPS'), self.db.check_table_df('TRIPS', engine='numpy'))
+
+        # NULL est une valeur comme une autre; une collation déclarée est respectée
+        self.db._conn.execute('CREATE TABLE `NULLS`(`a`, `b`);')
+        self.db._conn.execute("INSERT INTO `NULLS` VALUES (1, 'x'), (1, NULL), (2, 'y'), (2, 'z'), (NULL, 'u'), "
+                              "(NULL, 'v'), (3, 'w'), (3, 'w');")
+        self.db._conn.execute('CREATE TABLE `CASES`(`a` COLLATE NOCASE, `b`);')
+        self.db._conn.execute("INSERT INTO `CASES` VALUES ('x', 1), ('X', 2), ('y', 1);")
+
+        try:
+            self.db.add_df('NULLS', 'a', 'b')
+            self.db.add_df('CASES', 'a', 'b')
+
+            res = self.db.check_table_df('NULLS', engine='numpy')
+            self.assertEqual(self.db.check_table_df('NULLS'), res)
+            self.assertEqual([(1, 'x'), (1, None), (2, 'y'), (2, 'z'), (None, 'u'), (None, 'v')],
+                             res[('NULLS', 'a', 'b')])
+
+            res = self.db.check_table_df('CASES', engine='numpy')
+            self.assertEqual(self.db.check_table_df('CASES'), res)
+            self.assertEqual([('x', 1), ('X', 2)], res[('CASES', 'a', 'b')])
+        finally:
+            self.db.purge_df()
+            self.db._conn.execute('DROP TABLE `NULLS`;')
+            self.db._conn.execute('DROP TABLE `CASES`;')
+            self.db._conn.commit()
+
+    def test_sample_df(self):
+        self.db.purge_df()
+        self.db.add_df('TRIPS', 'Driver', 'Number_Plate')
+        self.db.add_df('BUSES', 'Number_Plate', 'Chassis')
+
+        res = self.db.sample_df(100, seed=1)
+        ok = res[('BUSES', 'Number_Plate', 'Chassis')]
+        bad = res[('TRIPS', 'Driver', 'Number_Plate')]
+
+        self.assertEqual(0, ok.hits)
+        self.assertLess(0, bad.hits)
+        self.assertTrue(bad.low <= bad.hits / bad.size <= bad.high)
+        self.assertFalse(bad.probed)
+
+        # Avec un index (prémisse, champ déterminé) les groupes sont vérifiés dans la table
+        self.db._conn.execute('CREATE INDEX `trips_driver` ON `TRIPS`(`Driver`, `Number_Plate`);')
+
+        try:
+            bad = self.db.sample_df(2, 'TRIPS', seed=1)[('TRIPS', 'Driver', 'Number_Plate')]
+            self.assertTrue(bad.probed)
+            self.assertEqual(len(set(self.db.check_table_df('TRIPS')[('TRIPS', 'Driver', 'Number_Plate')])
+                                 & set(bad.rows)), bad.hits)
+        finally:
+            self.db._conn.execute('DROP INDEX `trips_driver`;')
+
+    def test_df_error(self):
+        self.db.purge_df()
+        self.db.add_df('TRIPS', 'Driver', 'Number_Plate')
+        self.db.add_df('TRIPS', 'Driver', 'Date')
+        self.db.add_df('BUSES', 'Number_Plate', 'Chassis')
+
+        self.assertEqual(0, self.db.df_error('BUSES')[('BUSES', 'Number_Plate', 'Chassis')].removed)
+
+        res = self.db.df_error('TRIPS', worst=2)
+        self.assertEqual(self.db.list_table_df('TRIPS'), list(res))
+
+        for df, error in res.items():
+            # Même mesure en SQL: dans chaque groupe on garde les tuples de la valeur la plus fréquente
+            c = self.db._conn.execute('SELECT COUNT(*), SUM(`n` - `m`) FROM (SELECT SUM(`c`) AS `n`, MAX(`c`) AS `m` '
+                                      'FROM (SELECT `Driver`, COUNT(*) AS `c` FROM `TRIPS` GROUP BY `Driver`, {0}) '
+                                      'GROUP BY `Driver` HAVING COUNT(*) > 1);'.format(utils.quote(df[2])))
+            groups, removed = c.fetchone()
+
+            self.assertEqual(removed, error.removed)
+            self.assertEqual(groups, error.groups)
+            self.assertEqual(groups, len([v for v in self.db.iter_violations('TRIPS') if v.df == df]))
+            self.assertAlmostEqual(removed / error.rows, error.g3)
+            self.assertEqual(min(2, groups), len(error.worst))
+            self.assertEqual(sorted(error.worst, key=lambda g: -g.removed), error.worst)
+
+        with self.assertRaises(funcdep.UnknownTableError):
+            self.db.df_error('NOT_A_TABLE')
+
+        # Les valeurs sont comparées selon la collation déclarée, NULL est une valeur comme une autre
+        self.db._conn.execute('CREATE TABLE `CASES`(`a` COLLATE NOCASE, `b` COLLATE NOCASE);')
+        self.db._conn.execute("INSERT INTO `CASES` VALUES ('k', 'x'), ('K', 'X'), ('l', 'y'), ('L', 'y'), "
+                              "('l', NULL), ('m', 'z');")
+
+        try:
+            self.db.add_df('CASES', 'a', 'b')
+            self.db.add_df('CASES', 'b', 'a')
+
+            res = self.db.df_error('CASES')
+            error = res[('CASES', 'a', 'b')]
+
+            self.assertEqual((6, 1, 1), (error.rows, error.removed, error.groups))
+            self.assertEqual([(3, 2, 1)], [g[1:] for g in error.worst])
+            self.assertEqual('l', error.worst[0].lhs[0].lower())
+            self.assertEqual(0, res[('CASES', 'b', 'a')].removed)
+        finally:
+            self.db.purge_df()
+            self.db._conn.execute('DROP TABLE `CASES`;')
+            self.db._conn.commit()
+
+    def test_check_temporary_index(self):
+        self.db.purge_df()
+        self.db.add_df('TRIPS', 'Driver', 'Number_Plate')
+        self.db.add_df('TRIPS', 'Date Driver Departure_Time', 'Destination')
+
+        expected = self.db.check_df(auto_index=False)
+
+        self.db._AUTO_INDEX_MIN_ROWS = 0
+        self.db.set_instrumentation(True)
+
+        self.assertEqual(expected, self.db.check_df())
+
+        # La prémisse couverte par la clef primaire n'a pas besoin d'index
+        created = [sql for sql in self.db.stats()['statements'] if sql.startswith('CREATE INDEX')]
+        self.assertEqual(['CREATE INDEX IF NOT EXISTS `funcdep_tmp_TRIPS_0` ON `TRIPS`(`Driver`, `Number_Plate`);'],
+                         created)
+
+        conn = sqlite3.connect(TEST_DB)
+        indexes = conn.execute('SELECT name FROM sqlite_master WHERE type = "index" AND name LIKE "funcdep_tmp%"')
+        self.assertEqual([], indexes.fetchall())
+        conn.close()
+
+    def test_check_changes(self):
+        self.db.purge_df()
+        self.db.add_df('BUSES', 'Chassis', 'Make')
+        self.db.enable_incremental('BUSES')
+
+        self.assertEqual(['BUSES'], self.db.incremental_tables())
+
+        # La première vérification porte sur toute la table, les suivantes sur les modifications
+        self.assertEqual(self.db.check_df(), self.db.check_changes())
+        self.assertNotEqual([], self.db.check_df()[('BUSES', 'Chassis', 'Make')])
+        self.assertEqual({('BUSES', 'Chassis', 'Make'): []}, self.db.check_changes())
+
+        conn = sqlite3.connect(TEST_DB)
+        conn.execute('INSERT INTO `BUSES` VALUES ("QRS 555", "ZXRY9823", "Renault", 1000);')
+        conn.commit()
+
+        expected = [("LPG 234", "ZXRY9823", "Mercedes", 321734), ("QRS 555", "ZXRY9823", "Renault", 1000)]
+        self.assertEqual({('BUSES', 'Chassis', 'Make'): expected}, self.db.check_changes())
+        self.assertEqual({('BUSES', 'Chassis', 'Make'): []}, self.db.check_changes())
+
+        # Une DF ajoutée après coup est d'abord vérifiée sur toute la table
+        self.db.add_df('BUSES', 'Make', 'Chassis')
+        df = ('BUSES', 'Make', 'Chassis')
+        res = self.db.check_changes('BUSES')
+        self.assertEqual(self.db.check_table_df('BUSES')[df], res[df])
+        self.assertNotEqual([], res[df])
+        self.assertEqual([], self.db.check_changes('BUSES')[df])
+
+        self.db.disable_incremental()
+        self.assertEqual([], self.db.incremental_tables())
+
+        conn.execute('DELETE FROM `BUSES` WHERE `Number_Plate` = "QRS 555";')
+        conn.commit()
+        conn.close()
+
+    def test_iter_violations(self):
+        self.db.purge_df()
+        self.db.add_df('TRIPS', 'Driver', 'Number_Plate')
+        self.db.add_df('TRIPS', 'Date Driver Departure_Time', 'Destination')
+
+        res = sorted(self.db.iter_violations('TRIPS'))
+        self.assertEqual([('John',), ('Tim',)], [v.lhs for v in res])
+        self.assertEqual([2, 4], [v.count for v in res])
+        self.assertEqual([2, 2], [v.rhs_count for v in res])
+        self.assertEqual([1, 4], res[0].sample)
+
+        res = list(self.db.iter_violations('TRIPS', limit_per_df=1, summary=False))
+        self.assertEqual(1, len(res))
+        self.assertEqual(('Tim',), res[0].lhs)
+        self.assertEqual(4, len(res[0].sample))
+
+    def test_add_dfs(self):
+        self.db.purge_df()
+        self.db.add_df('BUSES', 'Chassis', 'Make')
+
+        with self.assertRaises(funcdep.DFBatchError) as cm:
+            self.db.add_dfs([('BUSES', 'Number_Plate', 'Make'),
+                             ('RANDOM', 'Chassis', 'Make'),
+                             ('BUSES', 'Chassis', 'Make'),
+                             ('BUSES', 'Number_Plate', 'Random')])
+
+        self.assertEqual([1, 2, 3], [e[0] for e in cm.exception.errors])
+        self.assertIsInstance(cm.exception.errors[0][2], funcdep.UnknownTableError)
+        self.assertIsInstance(cm.exception.errors[1][2], funcdep.DFAddTwiceError)
+        self.assertEqual(1, len(self.db.list_df()))
+
+        self.db.add_dfs([('BUSES', 'Number_Plate', 'Make'), ('TRIPS', 'Date Driver Departure_Time', 'Destination')])
+        self.assertEqual(3, len(self.db.list_df()))
+
+    def test_export_import_dfs(self):
+        self.db.purge_df()
+        self.db.add_df('BUSES', 'Chassis', 'Make')
+        self.db.add_df('TRIPS', 'Date Driver Departure_Time', 'Destination')
+        expected = self.db.list_df()
+
+        for path in ('dfs.csv', 'dfs.json'):
+            self.db.export_dfs(path)
+            self.db.purge_df()
+            self.db.import_dfs(path)
+            os.remove(path)
+
+            self.assertEqual(sorted(expected), sorted(self.db.list_df()))
+
     def test_df_closure(self):
         self.db.purge_df()
 
@@ -153,6 +523,55 @@ class FuncDepTest(unittest.TestCase):
         for r in expected_result:
             self.assertIn(r, result)
 
+    def test_df_closure_chain(self):
+        dfs = [('T', 'A', 'B'), ('T', 'B C', 'D'), ('T', 'D', 'E'), ('T', '', 'C')]
+
+        self.assertEqual(['A', 'B', 'C', 'D', 'E'], sorted(self.db.df_closure('A', dfs)))
+        self.assertEqual(['E', 'C'], self.db.df_closure('E', dfs))
+
+    def test_closure_cache(self):
+        self.db.purge_df()
+        self.db.add_df('BUSES', 'Number_Plate', 'Chassis')
+        self.db.add_df('BUSES', 'Chassis', 'Make')
+
+        start = self.db.closure_cache_info()
+        self.assertEqual(['Number_Plate', 'Chassis', 'Make'], self.db.table_closure('BUSES', 'Number_Plate'))
+        self.assertEqual(['Number_Plate', 'Chassis', 'Make'], self.db.table_closure('BUSES', 'Number_Plate'))
+
+        # Le sous-ensemble Number_Plate déjà calculé sert de point de départ
+        self.assertEqual(['Chassis', 'Number_Plate', 'Make'], self.db.table_closure('BUSES', 'Chassis Number_Plate'))
+
+        info = self.db.closure_cache_info()
+        self.assertEqual(1, info['hits'] - start['hits'])
+        self.assertEqual(2, info['misses'] - start['misses'])
+        self.assertEqual(1, info['reused'] - start['reused'])
+
+        # Une nouvelle DF change la version: l'ancienne fermeture n'est plus utilisée
+        self.db.add_df('BUSES', 'Make', 'Mileage')
+        self.assertEqual(['Number_Plate', 'Chassis', 'Make', 'Mileage'], self.db.table_closure('BUSES', 'Number_Plate'))
+
+        cache = funcdep.ClosureCache(size=1)
+        compiled = funcdep.CompiledDFs([('T', 'A', 'B')])
+        cache.closure_mask('T', 0, compiled, compiled.mask(['A']))
+        cache.closure_mask('T', 0, compiled, compiled.mask(['B']))
+        self.assertEqual(1, cache.info()['entries'])
+
+    def test_key(self):
+        self.db.purge_df()
+
+        self.db.add_df('BUSES', 'Number_Plate', 'Chassis')
+        self.db.add_df('BUSES', 'Number_Plate', 'Make')
+        self.db.add_df('BUSES', 'Number_Plate', 'Mileage')
+        self.db.add_df('BUSES', 'Chassis', 'Number_Plate')
+
+        self.assertEqual([['Number_Plate'], ['Chassis']], self.db.key('BUSES'))
+        self.assertEqual([['Date', 'Number_Plate', 'Driver', 'Destination', 'Departure_Time']], self.db.key('TRIPS'))
+
+        super_keys = self.db.super_key('BUSES')
+        self.assertEqual(12, len(super_keys))
+        for sk in super_keys:
+            self.assertTrue(self.db.is_key('BUSES', utils.list2str(sk)))
+
     def test_detect_useless_df(self):
         self.db.purge_df()
 
@@ -191,5 +610,288 @@ class FuncDepTest(unittest.TestCase):
 
         self.assertEqual(0, len(self.db.find_useless_df()))
 
+    def test_minimal_cover(self):
+        self.db.purge_df()
+
+        self.db.add_df('BUSES', 'Number_Plate', 'Chassis')
+        self.db.add_df('BUSES', 'Chassis', 'Make')
+        self.db.add_df('BUSES', 'Number_Plate', 'Make')
+        self.db.add_df('BUSES', 'Number_Plate Chassis', 'Mileage')
+        self.db.add_df('TRIPS', 'Date Driver Departure_Time', 'Destination')
+
+        expected = [('BUSES', 'Number_Plate', 'Chassis'),
+                    ('BUSES', 'Chassis', 'Make'),
+                    ('BUSES', 'Number_Plate', 'Mileage')]
+
+        self.assertEqual(expected, self.db.minimal_cover('BUSES'))
+
+        self.db.clean()
+
+        self.assertEqual(sorted(expected), sorted(self.db.list_table_df('BUSES')))
+        self.assertEqual(1, len(self.db.list_table_df('TRIPS')))
+
+    def test_analyze(self):
+        self.db.purge_df()
+        self.db.add_df('BUSES', 'Number_Plate', 'Chassis')
+        self.db.add_df('BUSES', 'Chassis', 'Number_Plate')
+        self.db.add_df('BUSES', 'Number_Plate', 'Make')
+        self.db.add_df('BUSES', 'Make', 'Mileage')
+
+        analysis = self.db.analyze('BUSES')
+
+        self.assertEqual([['Number_Plate'], ['Chassis']], analysis.keys)
+        self.assertEqual({'Number_Plate', 'Chassis'}, analysis.prime)
+        self.assertEqual([('BUSES', 'Make', 'Mileage')], analysis.bcnf_violations)
+        self.assertEqual([('BUSES', 'Make', 'Mileage')], analysis.nf3_violations)
+        self.assertEqual([('BUSES', 'Make', 'Mileage')], self.db.is_3nf()['BUSES'])
+
+    def test_analysis_cache(self):
+        self.db.purge_df()
+        self.db.add_df('BUSES', 'Number_Plate', 'Chassis')
+        self.db.add_df('BUSES', 'Chassis', 'Make')
+
+        # Une transaction en cours n'est pas validée par le cache
+        conn = sqlite3.connect(TEST_DB)
+        visible = conn.execute('SELECT * FROM `FuncDep`').fetchall()
+        keys = self.db.key('BUSES')
+        self.assertTrue(self.db._conn.in_transaction)
+        self.assertEqual(visible, conn.execute('SELECT * FROM `FuncDep`').fetchall())
+        conn.close()
+
+        self.db._conn.commit()
+        self.assertEqual(keys, self.db.key('BUSES'))
+        violations = self.db.is_3nf_table('BUSES')
+        self.assertIn('FuncDepCache', self.db.tables)
+        self.assertNotIn('FuncDepCache', self.db.is_3nf())
+
+        # Une nouvelle session lit les résultats sans les recalculer
+        self.db.close()
+        self.db = funcdep.DB(TEST_DB)
+        compute = funcdep.CompiledDFs.keys
+        funcdep.CompiledDFs.keys = None
+
+        try:
+            self.assertEqual(keys, self.db.key('BUSES'))
+            self.assertEqual(violations, self.db.is_3nf_table('BUSES'))
+            self.assertEqual(4, len(self.db.super_key('BUSES')))
+        finally:
+            funcdep.CompiledDFs.keys = compute
+
+        # Les DF ont changé: les résultats gardés ne sont plus utilisés
+        self.db.add_df('BUSES', 'Mileage', 'Number_Plate')
+        self.assertEqual(0, self.db._conn.execute('SELECT COUNT(*) FROM `FuncDepCache` WHERE `table` = "BUSES"')
+                         .fetchone()[0])
+
+        # Base verrouillée par une autre connexion: l'écriture refusée ne laisse pas de transaction ouverte
+        self.db._conn.commit()
+        self.db._conn.execute('PRAGMA busy_timeout = 0')
+        conn = sqlite3.connect(TEST_DB)
+        conn.execute('BEGIN IMMEDIATE')
+
+        try:
+            self.assertEqual([['Mileage']], self.db.key('BUSES'))
+            self.assertFalse(self.db._conn.in_transaction)
+        finally:
+            conn.rollback()
+            conn.close()
+
+        self.db.purge_df()
+
+    def test_instrumentation(self):
+        self.assertEqual({}, self.db.stats())
+
+        self.db.set_instrumentation(True)
+        self.db.purge_df()
+        self.db.add_df('BUSES', 'Chassis', 'Make')
+        self.db.check_df()
+        self.db.clean()
+
+        stats = self.db.stats()
+        self.assertLess(0, stats['queries'])
+        self.assertEqual(1, stats['operations']['check'][0])
+        self.assertEqual(1, stats['operations']['clean'][0])
+        self.assertIsNotNone(stats['peak_memory'])
+
+        self.db.reset_stats()
+        self.assertEqual(0, self.db.stats()['queries'])
+
+        self.db.set_instrumentation(False)
+        self.assertEqual({}, self.db.stats())
+
+    def test_normalize(self):
+        self.db.purge_df()
+        self.db.add_df('BUSES', 'Number_Plate', 'Chassis')
+        self.db.add_df('BUSES', 'Chassis', 'Make')
+
+        self.db.normalize()
+
+        conn = sqlite3.connect('normalize.sqlite')
+        c = conn.cursor()
+
+        self.assertEqual(sorted([('XGUR6775', 'Renault'), ('XGUR6775', 'Mercedes'), ('ZXRY9823', 'Mercedes'),
+                                 ('XXZZ7345', 'Renault')]), sorted(c.execute('SELECT * FROM `BUSES_0`').fetchall()))
+        self.assertEqual(4, len(c.execute('SELECT * FROM `BUSES_1`').fetchall()))
+        self.assertEqual(6, len(c.execute('SELECT * FROM `TRIPS_0`').fetchall()))
+        self.assertIn(('BUSES_0', 'Chassis', 'Make'), c.execute('SELECT * FROM `FuncDep`').fetchall())
+
+        conn.close()
+        os.remove('normalize.sqlite')
+
+    def test_normalize_jobs(self):
+        self.db.purge_df()
+        self.db.add_df('BUSES', 'Number_Plate', 'Chassis')
+        self.db.add_df('BUSES', 'Chassis', 'Make')
+        self.db.add_df('TRIPS', 'Date Driver Departure_Time', 'Destination')
+
+        contents = []
+
+        for jobs, name in [(1, 'sequential.sqlite'), (2, 'parallel.sqlite')]:
+            path = os.path.join(os.getcwd(), name)
+            self.db.normalize(path=path, jobs=jobs)
+
+            conn = sqlite3.connect(path)
+            tables = [t[0] for t in conn.execute('SELECT name FROM sqlite_master WHERE type = "table" ORDER BY name')]
+            contents.append({t: sorted(conn.execute('SELECT * FROM {}'.format(utils.quote(t))).fetchall())
+                             for t in tables})
+            conn.close()
+            os.remove(path)
+
+        self.assertFalse(os.path.exists('normalize.sqlite'))
+        self.assertIn(('BUSES_0', 'Chassis', 'Make'), contents[1]['FuncDep'])
+        self.assertEqual(contents[0], contents[1])
+
+    def test_plan_normalize(self):
+        self.db.purge_df()
+        self.db.add_df('BUSES', 'Number_Plate', 'Chassis')
+        self.db.add_df('BUSES', 'Chassis', 'Make')
+
+        plan = self.db.plan_normalize()
+        tables = {nt.name: nt for nt in plan.tables}
+
+        self.assertFalse(os.path.exists('normalize.sqlite'))
+        self.assertEqual(['Chassis', 'Make'], tables['BUSES_0'].attributes)
+        self.assertEqual([['Chassis']], tables['BUSES_0'].keys)
+        self.assertEqual(4, tables['BUSES_0'].rows)
+        self.assertEqual(4, tables['BUSES_2'].rows)
+        self.assertLess(0, tables['BUSES_0'].size)
+
+        # Le plan enregistré est exécuté sans être recalculé
+        path = os.path.join(os.getcwd(), 'plan.json')
+        funcdep.write_plan(plan, path)
+        saved = funcdep.read_plan(path)
+        os.remove(path)
+        self.assertEqual(plan, saved)
+
+        self.db.normalize(saved)
+        conn = sqlite3.connect('normalize.sqlite')
+        self.assertEqual(4, len(conn.execute('SELECT * FROM `BUSES_0`').fetchall()))
+        conn.close()
+        os.remove('normalize.sqlite')
+
+        self.db.add_df('BUSES', 'Number_Plate', 'Mileage')
+        with self.assertRaises(funcdep.PlanOutdatedError):
+            self.db.normalize(saved)
+
+    def test_sql_loader(self):
+        path = os.path.join(os.getcwd(), 'script.sql')
+        with open(path, 'w') as file:
+            file.write("-- table; avec commentaire\nCREATE TABLE `SCRIPT`(`a`, `b` TEXT);\n"
+                       "CREATE TRIGGER `script_tr` AFTER INSERT ON `SCRIPT` BEGIN SELECT 1; END;\n")
+            for n in range(25):
+                file.write("INSERT INTO `SCRIPT` VALUES ({}, 'x;y -- z\n''q');\n".format(n))
+            file.write("BEGIN;\nINSERT INTO `SCRIPT` VALUES (25, 'a');\nCOMMIT;\n-- fin\n")
+
+        statements = list(utils.iter_sql_statements(path, chunk_size=16))
+        self.assertEqual(30, len(statements))
+        self.assertTrue(statements[1].endswith('END;'))
+
+        progress = []
+        conn = sqlite3.connect(':memory:')
+        count = utils.execute_sql_file(conn.cursor(), path, batch=10, chunk_size=64,
+                                       progress=lambda n, read: progress.append(n))
+        os.remove(path)
+
+        self.assertEqual(30, count)
+        self.assertEqual([10, 20, 30], progress)
+        self.assertFalse(conn.in_transaction)
+        self.assertEqual((26, "x;y -- z\n'q"), conn.execute('SELECT COUNT(*), MAX(`b`) FROM `SCRIPT`').fetchone())
+        conn.close()
+
+        # Instructions refusées ou ignorées dans une transaction
+        with open(path, 'w') as file:
+            file.write("PRAGMA foreign_keys=ON;\nCREATE TABLE `T`(`a`);\nINSERT INTO `T` VALUES (1);\n"
+                       "ATTACH ':memory:' AS `other`;\nDETACH `other`;\nVACUUM;\nINSERT INTO `T` VALUES (2);\n")
+
+        conn = sqlite3.connect(':memory:')
+        self.assertEqual(7, utils.execute_sql_file(conn.cursor(), path))
+        os.remove(path)
+
+        self.assertEqual((1,), conn.execute('PRAGMA foreign_keys').fetchone())
+        self.assertEqual((2,), conn.execute('SELECT COUNT(*) FROM `T`').fetchone())
+        conn.close()
+
+        # Les DF ajoutées par un script sont vues tout de suite
+        self.db.purge_df()
+        with open(path, 'w') as file:
+            file.write("INSERT INTO `FuncDep` VALUES ('BUSES', 'Number_Plate', 'Make');\n")
+
+        self.db.load_sql_file(path)
+        os.remove(path)
+
+        self.assertEqual([('BUSES', 'Number_Plate', 'Make')], self.db.list_df())
+        self.db.del_df('BUSES', 'Number_Plate', 'Make')
+
+    def test_bench_generator(self):
+        path = os.path.join(os.getcwd(), 'bench.sqlite')
+        dfs = funcdep_bench.generate_dfs(6, 'random', seed=3)
+        funcdep_bench.generate_db(path, 200, 6, dfs)
+
+        db = funcdep.DB(path)
+        for lhs, rhs in dfs:
+            db.add_df('BENCH', utils.list2str(lhs), rhs)
+
+        self.assertTrue(all(len(rows) == 0 for rows in db.check_df().values()))
+
+        db.close()
+        os.remove(path)
+
+    def test_async_db(self):
+        self.db.purge_df()
+        self.db._conn.commit()
+
+        async def run():
+            async with funcdep_async.AsyncDB(TEST_DB, workers=2) as db:
+                await db.add_df('BUSES', 'Chassis', 'Make')
+                await db.add_df('TRIPS', 'Driver', 'Number_Plate')
+
+                checks = await asyncio.gather(db.check_table_df('BUSES'), db.check_table_df('TRIPS'),
+                                              db.key('BUSES'))
+                violations = [v async for v in db.iter_violations('TRIPS')]
+                analysis = await db.analyze('BUSES')
+                await db.purge_df()
+
+                # Le délai dépassé interrompt la requête en cours
+                with self.assertRaises(asyncio.TimeoutError):
+                    await db.check_df(timeout=0)
+
+                # Une écriture en échec est annulée, DF en mémoire comprises
+                def failing(d):
+                    d.add_df('BUSES', 'Chassis', 'Make')
+                    raise sqlite3.OperationalError('database is locked')
+
+                with self.assertRaises(sqlite3.OperationalError):
+                    await db._call(failing, True)
+                self.assertEqual([], await db.list_df())
+
+                return checks, violations, analysis
+
+        (buses, trips, key), violations, analysis = asyncio.run(run())
+
+        self.assertEqual(2, len(buses[('BUSES', 'Chassis', 'Make')]))
+        self.assertEqual(6, len(trips[('TRIPS', 'Driver', 'Number_Plate')]))
+        self.assertEqual([['Number_Plate', 'Chassis', 'Mileage']], key)
+        self.assertEqual({'John', 'Tim'}, {v.lhs[0] for v in violations})
+        self.assertEqual([('BUSES', 'Chassis', 'Make')], analysis.bcnf_violations)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS `FuncDepCache`(
+    `table` VARCHAR NOT NULL,
+    `kind` VARCHAR NOT NULL,
+    `fingerprint` VARCHAR NOT NULL,
+    `value` TEXT NOT NULL,
+
+    CONSTRAINT `FuncDepCache_pk` PRIMARY KEY (`table`, `kind`)
+);
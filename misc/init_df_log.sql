@@ -0,0 +1,14 @@
+CREATE TABLE IF NOT EXISTS `FuncDepLog`(
+    `table` VARCHAR NOT NULL,
+    `row` INTEGER NOT NULL,
+
+    CONSTRAINT `FuncDepLog_pk` PRIMARY KEY (`table`, `row`)
+);
+
+CREATE TABLE IF NOT EXISTS `FuncDepChecked`(
+    `table` VARCHAR NOT NULL,
+    `lhs` VARCHAR NOT NULL,
+    `rhs` VARCHAR NOT NULL,
+
+    CONSTRAINT `FuncDepChecked_pk` PRIMARY KEY (`table`, `lhs`, `rhs`)
+);
@@ -1,5 +1,8 @@
+import codecs
+import csv
 import functools
-import copy
+import json
+import os
 import sqlite3
 
 
@@ -9,33 +12,141 @@ def list2str(l: list):
         
     return functools.reduce(lambda a, b: str(a)+' '+str(b), l)
 
-def get_all_subset(attributes: list):
-    res = [[]]
+def quote(name: str) -> str:
+    return '`' + name + '`'
 
-    if len(attributes) == 0:
-        return res
-    att_copy = copy.deepcopy(attributes)
+def _read_statements(sql_file: str, chunk_size: int):
+    """
+    Lit un script par morceaux et produit chaque instruction complète (au
+    sens de sqlite3.complete_statement) avec le nombre d'octets lus jusque-là.
+    Seule l'instruction en cours est gardée en mémoire.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    read = 0
 
-    for att in attributes:
-        att_copy.remove(att)
-        for sub in get_all_subset(att_copy):
-            res.append([att]+sub)
+    with open(sql_file, 'rb') as file:
+        while True:
+            chunk = file.read(chunk_size)
+            read += len(chunk)
+            buffer += decoder.decode(chunk, final=not chunk)
+            start = 0
+            end = buffer.find(';')
 
-    return res
+            while end != -1:
+                if sqlite3.complete_statement(buffer[start:end + 1]):
+                    statement = buffer[start:end + 1]
+                    start = end + 1
+
+                    if statement.strip() != ';':
+                        yield statement, read
+
+                end = buffer.find(';', end + 1)
+
+            buffer = buffer[start:]
+
+            if not chunk:
+                break
+
+    # Fin du fichier: un reste qui n'est pas un commentaire est exécuté tel quel pour que l'erreur soit signalée
+    if _first_keyword(buffer):
+        yield buffer, read
+
+def iter_sql_statements(sql_file: str, chunk_size: int = 1 << 20):
+    """Instructions d'un script SQL, lues au fur et à mesure (commentaires et chaînes intacts)"""
+    for statement, _ in _read_statements(sql_file, chunk_size):
+        yield statement
 
 def get_sql_statements(sql_file: str) -> list:
-    result = ''
-    with open(sql_file) as file:
-        result = functools.reduce(lambda x, y: x + y.strip(), file.readlines()).replace('\n', '')
+    return list(iter_sql_statements(sql_file))
+
+def _first_keyword(statement: str) -> str:
+    s = statement.lstrip()
+
+    while s.startswith('--') or s.startswith('/*'):
+        s = (s.partition('\n') if s.startswith('--') else s.partition('*/'))[2].lstrip()
+
+    return s.split(None, 1)[0].rstrip(';').upper() if s else ''
+
+# Instructions qui gèrent les transactions ou que SQLite refuse (ou ignore) dans une transaction
+_OUTSIDE_BATCH = ('BEGIN', 'COMMIT', 'END', 'ROLLBACK', 'VACUUM', 'ATTACH', 'DETACH', 'PRAGMA')
+
+def execute_sql_file(c: sqlite3.Cursor, sql_file: str, batch: int = 1000, progress=None,
+                     chunk_size: int = 1 << 20) -> int:
+    """
+    Exécute un script SQL lu en flux. Si aucune transaction n'est en cours,
+    les instructions sont validées par lots de batch; les BEGIN/COMMIT du
+    script (ceux d'un .dump par exemple) sont respectés et VACUUM, ATTACH,
+    DETACH et PRAGMA sont exécutés hors de nos lots. progress est appelé
+    après chaque lot avec le nombre d'instructions exécutées et d'octets lus.
+    Renvoie le nombre d'instructions exécutées.
+    """
+    conn = c.connection
+    managed = not conn.in_transaction
+    ours = False
+    pending = 0
+    count = 0
+    read = 0
 
-    return result.split(';')
+    for statement, read in _read_statements(sql_file, chunk_size):
+        count += 1
 
-def execute_sql_file(c: sqlite3.Cursor, sql_file: str) -> None:
-    for s in get_sql_statements(sql_file):
-        c.execute(s)
+        if not managed:
+            c.execute(statement)
+        elif _first_keyword(statement) in _OUTSIDE_BATCH:
+            # On valide d'abord notre lot: le script gère ses transactions ou l'instruction n'en veut pas
+            if ours and conn.in_transaction:
+                conn.commit()
+            ours = False
+            pending = 0
+            c.execute(statement)
+        else:
+            if not conn.in_transaction:
+                c.execute('BEGIN;')
+                ours = True
+
+            c.execute(statement)
+            pending += 1
+
+            if ours and pending >= batch:
+                conn.commit()
+                ours = False
+                pending = 0
+
+        if progress is not None and count % batch == 0:
+            progress(count, read)
+
+    if ours and conn.in_transaction:
+        conn.commit()
+
+    if progress is not None and count % batch != 0:
+        progress(count, read)
+
+    return count
 
 def print_list(l: iter):
     print()
     for e in l:
         print('- ' + str(e))
     print()
+
+def read_df_file(path: str) -> list:
+    """
+    Lit des DF dans un fichier CSV (colonnes table, lhs, rhs avec une ligne
+    d'entête) ou JSON (liste d'objets {"table", "lhs", "rhs"}).
+    """
+    with open(path, newline='') as file:
+        if os.path.splitext(path)[1].lower() == '.json':
+            return [(d['table'], d['lhs'], d['rhs']) for d in json.load(file)]
+
+        return [(d['table'], d['lhs'], d['rhs']) for d in csv.DictReader(file)]
+
+def write_df_file(path: str, dfs: list) -> None:
+    with open(path, 'w', newline='') as file:
+        if os.path.splitext(path)[1].lower() == '.json':
+            json.dump([{'table': t, 'lhs': l, 'rhs': r} for t, l, r in dfs], file, indent=4)
+            return
+
+        writer = csv.writer(file)
+        writer.writerow(['table', 'lhs', 'rhs'])
+        writer.writerows(dfs)